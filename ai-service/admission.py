@@ -0,0 +1,160 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from deadlines import DeadlineExceeded
+
+# Priority classes, most urgent first. Sheddable classes are rejected with a
+# retry hint instead of queueing behind urgent work, and may not use the
+# global slots reserved for non-sheddable classes.
+PRIORITY_CLASSES = {
+    'crisis': {'priority': 0, 'max_concurrency': 16, 'max_queue': None, 'queue_timeout': None, 'sheddable': False},
+    'chat': {'priority': 1, 'max_concurrency': 12, 'max_queue': 128, 'queue_timeout': 30.0, 'sheddable': False},
+    'stats': {'priority': 2, 'max_concurrency': 4, 'max_queue': 16, 'queue_timeout': 2.0, 'sheddable': True},
+    'batch': {'priority': 3, 'max_concurrency': 2, 'max_queue': 8, 'queue_timeout': 5.0, 'sheddable': True},
+}
+
+# Smoothing factor for the per-class service time average
+SERVICE_TIME_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; `retry_after` is in whole seconds"""
+
+    def __init__(self, priority_class, retry_after):
+        super().__init__(f"'{priority_class}' traffic shed, retry after {retry_after}s")
+        self.priority_class = priority_class
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Priority-aware concurrency limiter for model-bound requests.
+
+    Every class has its own concurrency limit and all classes share a global
+    one. A waiting request of a higher priority class always starts before a
+    lower one, and `reserved_slots` global slots can only be used by
+    non-sheddable classes so crisis and chat traffic never queue behind
+    analytics.
+    """
+
+    def __init__(self, max_concurrency=None, reserved_slots=None, classes=None):
+        self.max_concurrency = max_concurrency or int(os.getenv('ADMISSION_MAX_CONCURRENCY', 16))
+        if reserved_slots is None:
+            reserved_slots = int(os.getenv('ADMISSION_RESERVED_SLOTS', max(1, self.max_concurrency // 4)))
+        self.reserved_slots = min(reserved_slots, self.max_concurrency - 1)
+        self.classes = classes or PRIORITY_CLASSES
+
+        self._cond = threading.Condition()
+        self._total_active = 0
+        self._active = {name: 0 for name in self.classes}
+        self._waiting = {name: 0 for name in self.classes}
+        self._service_time = {name: 0.5 for name in self.classes}
+        self._metrics = {
+            name: {'admitted': 0, 'rejected': 0, 'max_wait_ms': 0.0}
+            for name in self.classes
+        }
+
+    def acquire(self, priority_class, max_wait=None):
+        """Block until `priority_class` may run.
+
+        Raises AdmissionRejected when shed, or DeadlineExceeded when `max_wait`
+        (the caller's remaining deadline) runs out first.
+        """
+        config = self.classes[priority_class]
+        started = time.monotonic()
+        with self._cond:
+            if self._waiting[priority_class] == 0 and self._can_start(priority_class):
+                self._start(priority_class, started)
+                return
+
+            if config['max_queue'] is not None and self._waiting[priority_class] >= config['max_queue']:
+                self._reject(priority_class)
+
+            timeout = config['queue_timeout']
+            deadline = None if timeout is None else started + timeout
+            caller_deadline = None if max_wait is None else started + max_wait
+            self._waiting[priority_class] += 1
+            try:
+                while not self._can_start(priority_class):
+                    now = time.monotonic()
+                    if caller_deadline is not None and caller_deadline <= now:
+                        raise DeadlineExceeded('deadline passed while queued for admission')
+                    if deadline is not None and deadline <= now:
+                        self._reject(priority_class)
+                    remaining = [limit - now for limit in (deadline, caller_deadline) if limit is not None]
+                    self._cond.wait(min(remaining) if remaining else None)
+            finally:
+                self._waiting[priority_class] -= 1
+                # Lower classes may have been held back by this waiter
+                self._cond.notify_all()
+            self._start(priority_class, started)
+
+    def release(self, priority_class, service_time):
+        with self._cond:
+            self._active[priority_class] -= 1
+            self._total_active -= 1
+            self._service_time[priority_class] += SERVICE_TIME_ALPHA * (
+                service_time - self._service_time[priority_class]
+            )
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, priority_class, max_wait=None):
+        """Context manager around acquire/release"""
+        self.acquire(priority_class, max_wait)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(priority_class, time.monotonic() - started)
+
+    def get_metrics(self):
+        with self._cond:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'reserved_slots': self.reserved_slots,
+                'active': self._total_active,
+                'classes': {
+                    name: {
+                        'active': self._active[name],
+                        'waiting': self._waiting[name],
+                        'avg_service_ms': round(self._service_time[name] * 1000, 1),
+                        **{key: round(value, 1) for key, value in self._metrics[name].items()},
+                    }
+                    for name in self.classes
+                },
+            }
+
+    def _can_start(self, priority_class):
+        config = self.classes[priority_class]
+        if self._active[priority_class] >= config['max_concurrency']:
+            return False
+
+        global_limit = self.max_concurrency
+        if config['sheddable']:
+            global_limit -= self.reserved_slots
+        if self._total_active >= global_limit:
+            return False
+
+        # Defer to any higher priority class that is waiting and could run
+        for name, other in self.classes.items():
+            if (other['priority'] < config['priority'] and self._waiting[name]
+                    and self._active[name] < other['max_concurrency']):
+                return False
+        return True
+
+    def _start(self, priority_class, started):
+        self._active[priority_class] += 1
+        self._total_active += 1
+        metrics = self._metrics[priority_class]
+        metrics['admitted'] += 1
+        metrics['max_wait_ms'] = max(metrics['max_wait_ms'], (time.monotonic() - started) * 1000)
+
+    def _reject(self, priority_class):
+        self._metrics[priority_class]['rejected'] += 1
+        config = self.classes[priority_class]
+        backlog = self._waiting[priority_class] + self._active[priority_class] + 1
+        estimate = self._service_time[priority_class] * backlog / max(1, config['max_concurrency'])
+        raise AdmissionRejected(priority_class, max(1, min(60, math.ceil(estimate))))
@@ -1,11 +1,28 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
 import time
+import atexit
+import hmac
+import signal
+import threading
+import tempfile
+import requests
 from datetime import datetime
+from functools import wraps
+from admission import AdmissionController, AdmissionRejected
+from deadlines import DeadlineExceeded, parse_deadline, remaining_time, reset_deadline, set_deadline
 from gemini_chatbot import GeminiChatbot
-from gemini_mood_detector import GeminiMoodDetector
+from gemini_mood_detector import GeminiMoodDetector, ROLLUP_TIERS, contains_crisis_language
+from mood_columnar import ColumnarFormatError
+from model_router import get_default_router, set_default_router, start_model_call_log, stop_model_call_log
+from mood_pipeline import MoodPipeline
+from sampling_profiler import get_default_profiler
+from traffic_capture import (
+    TRACED_ROUTES, TrafficRecorder, create_replay_router, reset_replay_latencies, set_replay_latencies
+)
+from user_state_store import get_default_budget
 
 # Try to load environment variables, but don't fail if .env doesn't exist
 try:
@@ -16,16 +33,155 @@ except:
 app = Flask(__name__)
 CORS(app)
 
+# Replay mode answers model calls with recorded latencies instead of calling Gemini
+replay_mode = os.getenv('AI_REPLAY_MODE') == '1'
+replay_router = set_default_router(create_replay_router()) if replay_mode else None
+
 # Initialize Gemini services
 try:
-    chatbot = GeminiChatbot()
-    mood_detector = GeminiMoodDetector()
+    chatbot = GeminiChatbot(router=replay_router)
+    mood_detector = GeminiMoodDetector(router=replay_router)
     print("✅ Gemini services initialized successfully")
 except Exception as e:
     print(f"❌ Failed to initialize Gemini services: {e}")
     chatbot = None
     mood_detector = None
 
+# Background post-processing for mood writes (history, stats refresh, alerts)
+mood_pipeline = None
+if mood_detector:
+    mood_pipeline = MoodPipeline(mood_detector).start()
+    atexit.register(mood_pipeline.shutdown)
+
+    # atexit does not run on SIGTERM (the usual stop signal), so drain there too
+    if threading.current_thread() is threading.main_thread():
+        previous_sigterm_handler = signal.getsignal(signal.SIGTERM)
+
+        def drain_on_sigterm(signum, frame):
+            mood_pipeline.shutdown()
+            if callable(previous_sigterm_handler):
+                previous_sigterm_handler(signum, frame)
+            elif previous_sigterm_handler != signal.SIG_IGN:
+                raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, drain_on_sigterm)
+
+    alert_webhook_url = os.getenv('MOOD_ALERT_WEBHOOK_URL')
+    if alert_webhook_url:
+        def post_mood_alert(user_id, alert):
+            requests.post(alert_webhook_url, json=alert, timeout=5)
+
+        mood_pipeline.add_alert_listener(post_mood_alert)
+
+# Priority-aware admission control in front of the model-bound routes
+admission = AdmissionController()
+
+def admitted(priority_class, on_deadline=None):
+    """Run the view under an admission class; a callable is resolved per request.
+
+    When the deadline passes while queued, `on_deadline` (if given) builds the
+    response instead of a 504.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            resolved_class = priority_class() if callable(priority_class) else priority_class
+            try:
+                with admission.admit(resolved_class, max_wait=remaining_time()):
+                    return view(*args, **kwargs)
+            except AdmissionRejected as e:
+                return jsonify({
+                    'success': False,
+                    'error': 'Service is busy, please retry later'
+                }), 429, {'Retry-After': str(e.retry_after)}
+            except DeadlineExceeded:
+                if on_deadline is not None:
+                    return on_deadline()
+                return deadline_exceeded_response()
+        return wrapper
+    return decorator
+
+def deadline_exceeded_response():
+    return jsonify({
+        'success': False,
+        'error': 'Request deadline exceeded'
+    }), 504
+
+# Opt-in anonymized traffic capture (AI_TRACE_FILE) for offline load replay
+traffic_recorder = TrafficRecorder.from_env()
+if traffic_recorder:
+    atexit.register(traffic_recorder.close)
+    print(f"📼 Recording traffic traces to {traffic_recorder.path}")
+
+@app.before_request
+def start_traffic_capture():
+    """Start a trace for traced routes and load replayed model latencies"""
+    if replay_mode:
+        g.replay_token = set_replay_latencies(request.headers)
+    if traffic_recorder and request.path in TRACED_ROUTES:
+        g.traffic_trace = traffic_recorder.begin(request.path, request.get_json(silent=True))
+        g.model_call_log, g.model_call_token = start_model_call_log()
+
+@app.after_request
+def finish_traffic_capture(response):
+    trace = g.pop('traffic_trace', None)
+    if trace is not None:
+        traffic_recorder.finish(trace, response.status_code, g.model_call_log)
+    return response
+
+# On-demand stack sampling, controlled through the admin /profiler endpoints
+profiler = get_default_profiler()
+
+@app.before_request
+def start_request_profile():
+    """Sample this request's thread, labelled by route, while profiling is on"""
+    if profiler.active and request.url_rule is not None and not request.path.startswith('/profiler'):
+        g.profile_token = profiler.begin(request.url_rule.rule)
+
+@app.teardown_request
+def end_request_profile(exc=None):
+    token = g.pop('profile_token', None)
+    if token is not None:
+        profiler.end(token)
+
+@app.teardown_request
+def clear_traffic_capture(exc=None):
+    token = g.pop('model_call_token', None)
+    if token is not None:
+        stop_model_call_log(token)
+    token = g.pop('replay_token', None)
+    if token is not None:
+        reset_replay_latencies(token)
+
+@app.before_request
+def apply_request_deadline():
+    """Propagate the caller's deadline header to every model call in this request"""
+    deadline = parse_deadline(request.headers)
+    g.deadline_token = set_deadline(deadline)
+    # /crisis-check and /chat still answer from keywords alone once the deadline has passed
+    if deadline is not None and remaining_time() <= 0 and request.endpoint not in ('crisis_check', 'chat'):
+        return deadline_exceeded_response()
+
+@app.teardown_request
+def clear_request_deadline(exc=None):
+    token = g.pop('deadline_token', None)
+    if token is not None:
+        reset_deadline(token)
+
+def require_admin():
+    """Error response unless the request carries AI_ADMIN_TOKEN; admin routes are off without it"""
+    admin_token = os.getenv('AI_ADMIN_TOKEN')
+    if not admin_token:
+        return jsonify({'success': False, 'error': 'Admin endpoints are disabled'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token):
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    return None
+
+def chat_priority():
+    """Chat turns that may contain a crisis are scheduled as crisis traffic"""
+    data = request.get_json(silent=True) or {}
+    return 'crisis' if contains_crisis_language(data.get('message')) else 'chat'
+
 @app.route('/health', methods=['GET']) 
 def health_check():
     """Health check endpoint"""
@@ -34,9 +190,27 @@ def health_check():
         'gemini_available': chatbot is not None and mood_detector is not None
     })
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    """Chat endpoint with mood detection and Gemini-powered responses in chronological order"""
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Runtime metrics for the AI service"""
+    return jsonify({
+        'success': True,
+        'pipeline': mood_pipeline.get_metrics() if mood_pipeline else None,
+        'memory': get_default_budget().get_metrics(),
+        'admission': admission.get_metrics(),
+        'models': get_default_router().get_metrics()
+    })
+
+# Reply used when the deadline leaves no time for the model
+DEADLINE_CHAT_REPLY = ("I'm having trouble responding right now, but I'm still here with you. "
+                       "Could you tell me a little more about how you're feeling?")
+
+def run_chat():
+    """Chat turn for the current request.
+
+    Once the deadline passes, the turn is answered with a canned reply and
+    keyword-only crisis detection so emergencies are still flagged.
+    """
     try:
         data = request.get_json()
         user_message_text = data.get('message', '').strip()
@@ -55,25 +229,27 @@ def chat():
             'userId': user_id
         }
 
-        # Store user message in mood detector (optional)
+        # Detect mood for the user message (optional)
         mood_analysis = None
+        deadline_exceeded = False
         if mood_detector:
-            mood_analysis = mood_detector.detect_mood(user_message_text)
-            if mood_analysis['success']:
-                mood_detector.store_user_score(
-                    user_id=user_id,
-                    score=mood_analysis['score'],
-                    emotion=mood_analysis['emotion'],
-                    confidence=mood_analysis['confidence'],
-                    text=user_message_text
-                )
+            try:
+                mood_analysis = mood_detector.detect_mood(user_message_text)
+            except DeadlineExceeded:
+                deadline_exceeded = True
 
         # Generate bot response
-        if chatbot:
-            bot_resp = chatbot.generate_response(
-                user_message=user_message_text,
-                conversation_history=conversation_history
-            )
+        bot_resp = None
+        if chatbot and not deadline_exceeded:
+            try:
+                bot_resp = chatbot.generate_response(
+                    user_message=user_message_text,
+                    conversation_history=conversation_history
+                )
+            except DeadlineExceeded:
+                deadline_exceeded = True
+
+        if bot_resp:
             bot_message = {
                 'id': str(int(time.time() * 1000) + 1),
                 'message': bot_resp['message'],
@@ -83,6 +259,15 @@ def chat():
                 'moodAnalysis': mood_analysis,
                 'suggestions': bot_resp.get('suggestions', [])
             }
+        elif deadline_exceeded:
+            bot_message = {
+                'id': str(int(time.time() * 1000) + 1),
+                'message': DEADLINE_CHAT_REPLY,
+                'isBot': True,
+                'timestamp': datetime.utcnow().isoformat(),
+                'userId': 'bot',
+                'moodAnalysis': mood_analysis
+            }
         else:
             bot_message = {
                 'id': str(int(time.time() * 1000) + 1),
@@ -102,11 +287,26 @@ def chat():
         emergency_triggered = False
         crisis_detection = None
         if mood_analysis and mood_analysis['success'] and mood_detector:
-            emergency_triggered = mood_detector.should_trigger_emergency_alert(user_id, mood_analysis['score'])
+            emergency_triggered = mood_detector.should_trigger_emergency_alert(
+                user_id, mood_analysis['score'], pending_scores=mood_pipeline.pending_scores(user_id)
+            )
             crisis_detection = mood_detector.detect_crisis_situation(user_message_text, mood_analysis)
             if crisis_detection['requires_immediate_intervention']:
                 emergency_triggered = True
 
+            # Store the score after the response is sent
+            mood_pipeline.submit(
+                user_id, mood_analysis, text=user_message_text,
+                emergency_triggered=emergency_triggered
+            )
+        elif deadline_exceeded and mood_detector:
+            # No model answer in time: fall back to keyword-only crisis detection
+            crisis_detection = mood_detector.detect_crisis_situation(user_message_text, None)
+            emergency_triggered = crisis_detection['requires_immediate_intervention']
+
+        if emergency_triggered and deadline_exceeded and chatbot:
+            bot_message['message'] = chatbot.get_emergency_response()['message']
+
         # Prepare result for frontend
         result = {
             'success': True,
@@ -123,9 +323,16 @@ def chat():
     except Exception as e:
         return jsonify({'success': False, 'error': f'Internal server error: {str(e)}'}), 500
 
+@app.route('/chat', methods=['POST'])
+@admitted(chat_priority, on_deadline=run_chat)
+def chat():
+    """Chat endpoint with mood detection and Gemini-powered responses in chronological order"""
+    return run_chat()
+
 
 
 @app.route('/detect-emotion', methods=['POST'])
+@admitted('chat')
 def detect_emotion():
     """Detect emotion from text"""
     try:
@@ -149,23 +356,24 @@ def detect_emotion():
         mood_analysis = mood_detector.detect_mood(text)
         
         if mood_analysis['success']:
-            # Store mood data
-            mood_detector.store_user_score(
-                user_id=user_id,
-                score=mood_analysis['score'],
-                emotion=mood_analysis['emotion'],
-                confidence=mood_analysis['confidence'],
-                text=text
-            )
+            # Scores still queued for this user count as history for both checks
+            pending_scores = mood_pipeline.pending_scores(user_id)
             
             # Check for significant deviation
             deviation_analysis = mood_detector.detect_significant_deviation(
-                user_id, mood_analysis['score']
+                user_id, mood_analysis['score'], pending_scores=pending_scores
             )
             
             # Check for emergency alert
             emergency_triggered = mood_detector.should_trigger_emergency_alert(
-                user_id, mood_analysis['score']
+                user_id, mood_analysis['score'], pending_scores=pending_scores
+            )
+            
+            # Store mood data and fan out alerts after the response is sent
+            mood_pipeline.submit(
+                user_id, mood_analysis, text=text,
+                deviation_analysis=deviation_analysis,
+                emergency_triggered=emergency_triggered
             )
             
             return jsonify({
@@ -186,19 +394,47 @@ def detect_emotion():
                 'error': mood_analysis['error']
             }), 500
             
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
             'error': f'Internal server error: {str(e)}'
         }), 500
 
-@app.route('/user-mood-stats', methods=['POST'])
+@app.route('/user-mood-stats', methods=['GET', 'POST'])
+@admitted('stats')
 def get_user_mood_stats():
-    """Get user mood statistics and trend data"""
+    """Get user mood statistics and trend data.
+
+    GET takes query parameters and honours If-None-Match, answering 304 while
+    the user has no new entries. POST takes a JSON body and always returns one.
+    """
     try:
-        data = request.get_json()
+        if request.method == 'GET':
+            data = request.args
+            days = request.args.get('days', type=int)
+        else:
+            data = request.get_json()
+            days = data.get('days')
         user_id = data.get('userId', 'anonymous')
-        days = data.get('days', 30)
+        resolution = data.get('resolution', 'day')
+        
+        if resolution not in ROLLUP_TIERS:
+            return jsonify({
+                'success': False,
+                'error': f"resolution must be one of: {', '.join(ROLLUP_TIERS)}"
+            }), 400
+        
+        # Buckets older than the tier's retention are gone, so longer windows would be silently cut short
+        retention_days = ROLLUP_TIERS[resolution]['retention_days']
+        if days is None:
+            days = min(30, retention_days)
+        if isinstance(days, bool) or not isinstance(days, int) or not 0 < days <= retention_days:
+            return jsonify({
+                'success': False,
+                'error': f"days must be between 1 and {retention_days} for '{resolution}' resolution"
+            }), 400
         
         if not mood_detector:
             return jsonify({
@@ -206,15 +442,23 @@ def get_user_mood_stats():
                 'error': 'Mood detection service not available'
             }), 503
         
-        # Get mood statistics
-        stats = mood_detector.get_mood_statistics(user_id, days)
-        trend = mood_detector.get_mood_trend(user_id, days)
+        # Unchanged since the client's copy: skip the computation entirely
+        etag = mood_detector.get_mood_summary_etag(user_id, days, resolution)
+        if request.method == 'GET' and request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            # Get mood statistics from the precomputed rollups (memoized per version)
+            summary = mood_detector.get_mood_summary(user_id, days, resolution)
+            etag = summary['etag']
+            response = jsonify({
+                'success': True,
+                'statistics': summary['statistics'],
+                'trend': summary['trend']
+            })
         
-        return jsonify({
-            'success': True,
-            'statistics': stats,
-            'trend': trend
-        })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
         return jsonify({
@@ -223,6 +467,7 @@ def get_user_mood_stats():
         }), 500
 
 @app.route('/analyze-text', methods=['POST'])
+@admitted('batch')
 def analyze_text():
     """Comprehensive text analysis"""
     try:
@@ -246,29 +491,28 @@ def analyze_text():
         mood_analysis = mood_detector.detect_mood(text)
         
         if mood_analysis['success']:
-            # Store mood data
-            mood_detector.store_user_score(
-                user_id=user_id,
-                score=mood_analysis['score'],
-                emotion=mood_analysis['emotion'],
-                confidence=mood_analysis['confidence'],
-                text=text
-            )
-            
-            # Get user statistics
-            stats = mood_detector.get_mood_statistics(user_id, 30)
-            trend = mood_detector.get_mood_trend(user_id, 30)
+            # Latest user statistics snapshot, plus queued scores and the one being stored below
+            summary = mood_pipeline.get_summary(user_id)
+            pending_scores = mood_pipeline.pending_scores(user_id)
+            for score in pending_scores + [mood_analysis['score']]:
+                summary = mood_detector.summary_with_score(summary, score)
             
             # Check for deviation
             deviation_analysis = mood_detector.detect_significant_deviation(
-                user_id, mood_analysis['score']
+                user_id, mood_analysis['score'], pending_scores=pending_scores
+            )
+            
+            # Store mood data and refresh statistics after the response is sent
+            mood_pipeline.submit(
+                user_id, mood_analysis, text=text,
+                deviation_analysis=deviation_analysis
             )
             
             return jsonify({
                 'success': True,
                 'moodAnalysis': mood_analysis,
-                'statistics': stats,
-                'trend': trend,
+                'statistics': summary['statistics'],
+                'trend': summary['trend'],
                 'deviationAnalysis': deviation_analysis
             })
         else:
@@ -277,6 +521,8 @@ def analyze_text():
                 'error': mood_analysis['error']
             }), 500
             
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
@@ -297,6 +543,7 @@ def emergency_support():
         })
 
 @app.route('/coping-strategies', methods=['POST'])
+@admitted('chat')
 def get_coping_strategies():
     """Get personalized coping strategies based on emotion"""
     try:
@@ -313,15 +560,16 @@ def get_coping_strategies():
         strategies = chatbot.get_coping_strategies(emotion, intensity)
         return jsonify(strategies)
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
             'error': f'Internal server error: {str(e)}'
         }), 500
 
-@app.route('/crisis-check', methods=['POST'])
-def crisis_check():
-    """Check for crisis indicators in text"""
+def run_crisis_check(use_model=True):
+    """Crisis check for the current request; without the model only keywords are used"""
     try:
         data = request.get_json()
         text = data.get('text', '')
@@ -338,11 +586,16 @@ def crisis_check():
                 'error': 'Mood detection service not available'
             }), 503
         
-        # Detect mood first
-        mood_analysis = mood_detector.detect_mood(text)
+        # Detect mood first; past the deadline, fall back to keyword-only crisis detection
+        mood_analysis = None
+        if use_model:
+            try:
+                mood_analysis = mood_detector.detect_mood(text)
+            except DeadlineExceeded:
+                pass
         
-        # Check for crisis
-        crisis_detection = mood_detector.detect_crisis_situation(text, mood_analysis)
+        # Check for crisis; flagged text also gets a model assessment while time allows
+        crisis_detection = mood_detector.detect_crisis_situation(text, mood_analysis, enrich=use_model)
         
         return jsonify({
             'success': True,
@@ -356,6 +609,134 @@ def crisis_check():
             'error': f'Internal server error: {str(e)}'
         }), 500
 
+@app.route('/crisis-check', methods=['POST'])
+@admitted('crisis', on_deadline=lambda: run_crisis_check(use_model=False))
+def crisis_check():
+    """Check for crisis indicators in text"""
+    return run_crisis_check()
+
+@app.route('/mood-history/export', methods=['GET'])
+@admitted('batch')
+def export_mood_history():
+    """Stream all mood history in the columnar format (admin only)"""
+    denied = require_admin()
+    if denied:
+        return denied
+    
+    if not mood_detector:
+        return jsonify({
+            'success': False,
+            'error': 'Mood detection service not available'
+        }), 503
+    
+    writer = mood_detector.export_history()
+    
+    def generate():
+        try:
+            yield from writer.iter_bytes()
+        finally:
+            writer.close()
+    
+    return Response(generate(), mimetype='application/octet-stream', headers={
+        'Content-Disposition': 'attachment; filename=mood-history.moodcol',
+        'X-Row-Count': str(writer.rows)
+    })
+
+@app.route('/mood-history/import', methods=['POST'])
+@admitted('batch')
+def import_mood_history():
+    """Load mood history from a columnar upload without calling the model (admin only)"""
+    denied = require_admin()
+    if denied:
+        return denied
+    
+    if not mood_detector:
+        return jsonify({
+            'success': False,
+            'error': 'Mood detection service not available'
+        }), 503
+    
+    try:
+        # Spool the body to disk so the import can memory map it
+        with tempfile.NamedTemporaryFile(suffix='.moodcol') as upload:
+            while True:
+                chunk = request.stream.read(1 << 20)
+                if not chunk:
+                    break
+                upload.write(chunk)
+            upload.flush()
+            rows, skipped, users = mood_detector.import_history(upload.name)
+        
+        return jsonify({
+            'success': True,
+            'rowsImported': rows,
+            'rowsSkipped': skipped,
+            'usersImported': users
+        })
+        
+    except ColumnarFormatError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid mood history file: {str(e)}'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+@app.route('/profiler', methods=['GET'])
+def profiler_status():
+    """Profiling session state and samples per route (admin only)"""
+    denied = require_admin()
+    if denied:
+        return denied
+    return jsonify({'success': True, 'profiler': profiler.get_status()})
+
+@app.route('/profiler/start', methods=['POST'])
+def start_profiler():
+    """Start sampling a percentage of requests, optionally for a fixed window (admin only)"""
+    denied = require_admin()
+    if denied:
+        return denied
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        sample_percent = float(data.get('samplePercent', 100))
+        duration = data.get('durationSeconds')
+        duration = float(duration) if duration is not None else None
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'error': 'samplePercent and durationSeconds must be numbers'
+        }), 400
+    
+    if not 0 < sample_percent <= 100 or (duration is not None and duration <= 0):
+        return jsonify({
+            'success': False,
+            'error': 'samplePercent must be in (0, 100] and durationSeconds positive'
+        }), 400
+    
+    profiler.start(sample_rate=sample_percent / 100, duration=duration)
+    return jsonify({'success': True, 'profiler': profiler.get_status()})
+
+@app.route('/profiler/stop', methods=['POST'])
+def stop_profiler():
+    """Stop sampling; collected stacks remain available (admin only)"""
+    denied = require_admin()
+    if denied:
+        return denied
+    profiler.stop()
+    return jsonify({'success': True, 'profiler': profiler.get_status()})
+
+@app.route('/profiler/stacks', methods=['GET'])
+def profiler_stacks():
+    """Collapsed stacks for flamegraph tools, optionally for one route (admin only)"""
+    denied = require_admin()
+    if denied:
+        return denied
+    return Response(profiler.collapsed_stacks(request.args.get('route')), mimetype='text/plain')
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5001))
     debug = os.getenv('FLASK_ENV') == 'development'
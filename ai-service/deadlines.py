@@ -0,0 +1,56 @@
+import contextvars
+import math
+import time
+
+# Callers send either a relative budget or an absolute deadline (epoch ms)
+TIMEOUT_HEADER = 'X-Request-Timeout-Ms'
+DEADLINE_HEADER = 'X-Request-Deadline'
+
+# Longest budget a caller may ask for; larger values are clamped. Must stay
+# well below threading.TIMEOUT_MAX, which bounds every wait on the deadline.
+MAX_REQUEST_BUDGET_SECONDS = 300
+
+# Monotonic deadline of the request being handled, or None
+_current_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the caller's deadline passes before the work is done"""
+
+
+def parse_deadline(headers):
+    """Monotonic deadline from request headers, or None when none (or garbage) was sent"""
+    try:
+        if headers.get(TIMEOUT_HEADER):
+            remaining = float(headers[TIMEOUT_HEADER]) / 1000
+        elif headers.get(DEADLINE_HEADER):
+            remaining = float(headers[DEADLINE_HEADER]) / 1000 - time.time()
+        else:
+            return None
+    except ValueError:
+        return None
+    if not math.isfinite(remaining):
+        return None
+    return time.monotonic() + min(remaining, MAX_REQUEST_BUDGET_SECONDS)
+
+
+def set_deadline(deadline):
+    """Set the deadline for the current context; returns a token for reset_deadline"""
+    return _current_deadline.set(deadline)
+
+
+def reset_deadline(token):
+    _current_deadline.reset(token)
+
+
+def remaining_time():
+    """Seconds left before the deadline (may be negative), or None without one"""
+    deadline = _current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if the current deadline has already passed"""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded('request deadline exceeded')
@@ -1,6 +1,9 @@
 import google.generativeai as genai
 import os
 from dotenv import load_dotenv
+from deadlines import DeadlineExceeded
+from model_router import get_default_router
+from user_state_store import UserStateStore
 
 # Try to load .env file, but don't fail if it doesn't exist
 try:
@@ -8,17 +11,19 @@ try:
 except:
     pass
 
+# Estimated resident bytes per stored exchange, excluding the message text
+MESSAGE_BYTES = 250
+
+
+def _estimate_messages_bytes(messages):
+    return sum(MESSAGE_BYTES + len(msg['user']) + len(msg['assistant']) for msg in messages)
+
+
 class GeminiChatbot:
-    def __init__(self):
-        self.api_key = os.getenv('GEMINI_API_KEY')
-        if not self.api_key or self.api_key == 'your-gemini-api-key-here':
-            print("⚠️  GEMINI_API_KEY not configured - running in demo mode")
-            self.model = None
-            return
-        
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
-        self.user_messages = {} 
+    def __init__(self, router=None):
+        # key: user_id, value: list of messages; idle users are evicted under the memory budget
+        self.user_messages = UserStateStore('chat_messages', _estimate_messages_bytes)
+
         # Mental health context and instructions
         self.system_prompt = """
 You are a compassionate mental health support companion.
@@ -51,6 +56,18 @@ Always validate the user’s feelings first, then offer gentle suggestions.
 Remember: You are here to support, not to solve.
 """
 
+        # Model calls go through the router; an injected one (e.g. with fake models) skips the API key check
+        self.router = router
+        self.api_key = os.getenv('GEMINI_API_KEY')
+        if self.router is not None:
+            return
+        if not self.api_key or self.api_key == 'your-gemini-api-key-here':
+            print("⚠️  GEMINI_API_KEY not configured - running in demo mode")
+            return
+        
+        genai.configure(api_key=self.api_key)
+        self.router = get_default_router()
+
     def generate_response(self, user_message, conversation_history=None):
         """
         Generate a response using Gemini API with mental health context
@@ -63,7 +80,7 @@ Remember: You are here to support, not to solve.
             dict: Response with message, mood analysis, and suggestions
         """
         try:
-            if self.model is None:
+            if self.router is None:
                 return {
                     'message': "I'm here to listen and support you. While the AI features are not fully configured, I want you to know that your feelings are valid and important. If you're struggling, please consider reaching out to a mental health professional or a trusted friend.",
                     'success': True,
@@ -84,7 +101,7 @@ Remember: You are here to support, not to solve.
             context += "Please provide a supportive, empathetic response that addresses their concerns and offers helpful coping strategies."
             
             # Generate response
-            response = self.model.generate_content(context)
+            response = self.router.generate('chat_reply', context)
             
             return {
                 'message': response.text,
@@ -92,21 +109,65 @@ Remember: You are here to support, not to solve.
                 'error': None
             }
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             return {
                 'message': "I'm sorry, I'm having trouble processing your message right now. Please try again or reach out to a mental health professional if you need immediate support.",
                 'success': False,
                 'error': str(e)
             }
-# key: user_id, value: list of messages
 
     def store_message(self, user_id, user_msg, assistant_msg):
-        if user_id not in self.user_messages:
-            self.user_messages[user_id] = []
-        self.user_messages[user_id].append({
+        messages = self.user_messages.get(user_id, [])
+        messages.append({
             'user': user_msg,
             'assistant': assistant_msg
         })
+        # Write back so the memory budget sees the new size
+        self.user_messages[user_id] = messages
+
+    def get_coping_strategies(self, emotion, intensity='medium'):
+        """
+        Generate coping strategies for an emotion and intensity
+        
+        Returns:
+            dict: Response with a list of strategies
+        """
+        try:
+            if self.router is None:
+                return {
+                    'strategies': [
+                        'Take a few slow, deep breaths',
+                        'Write down what you are feeling',
+                        'Reach out to someone you trust'
+                    ],
+                    'success': True,
+                    'error': None
+                }
+            
+            prompt = f"""
+You are a compassionate mental health support companion.
+Suggest 3 to 5 short, practical coping strategies for someone feeling {emotion} at {intensity} intensity.
+Return one strategy per line with no numbering or extra text.
+"""
+            response = self.router.generate('coping_generation', prompt)
+            strategies = [line.strip(' -•*') for line in response.text.splitlines() if line.strip(' -•*')]
+            
+            return {
+                'strategies': strategies,
+                'success': True,
+                'error': None
+            }
+            
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return {
+                'strategies': [],
+                'success': False,
+                'error': str(e)
+            }
 
     def get_emergency_response(self):
         """Get emergency support response"""
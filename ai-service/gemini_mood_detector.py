@@ -1,9 +1,17 @@
 import google.generativeai as genai
+import numpy as np
 import os
 import json
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import statistics
+import itertools
+import threading
+import time
+from deadlines import DeadlineExceeded
+from model_router import get_default_router
+from mood_columnar import ColumnarFile, ColumnarWriter
+from user_state_store import UserStateStore
 
 # Load environment variables
 try:
@@ -11,19 +19,118 @@ try:
 except:
     pass
 
-class GeminiMoodDetector:
-    def __init__(self):
-        self.api_key = os.getenv('GEMINI_API_KEY')
-        if not self.api_key or self.api_key == 'your-gemini-api-key-here':
-            print("⚠️  GEMINI_API_KEY not configured - running in demo mode")
-            self.model = None
-            return
+# Raw entries kept per user; older data is only kept in the rollups
+MAX_RAW_ENTRIES = 100
 
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
+# Estimated resident bytes used to account user state against the memory budget
+HISTORY_ENTRY_BYTES = 300
+ROLLUP_BUCKET_BYTES = 180
+SUMMARY_BYTES = 1500
+TREND_POINT_BYTES = 350
+
+# Rows per vectorized step when importing columnar history
+IMPORT_CHUNK_ROWS = 250_000
+
+# Memoized (days, resolution) summaries kept per user for repeated dashboard polls
+MAX_SUMMARIES_PER_USER = 4
+
+# Rollup tiers: bucket width and how long buckets are retained
+ROLLUP_TIERS = {
+    'hour': {'seconds': 3600, 'retention_days': 7},
+    'day': {'seconds': 86400, 'retention_days': 400},
+    'week': {'seconds': 7 * 86400, 'retention_days': 5 * 365},
+}
+
+
+# Phrases that flag a message as a possible crisis
+CRISIS_INDICATORS = [
+    'suicide', 'kill myself', 'end it all', 'not worth living',
+    'better off dead', 'want to die', 'hurt myself', 'self harm',
+    'cut myself', 'overdose', 'jump off', 'hang myself',
+    'no point', 'hopeless', "can't go on", 'give up',
+    'nobody cares', 'alone forever', 'worthless', 'burden',
+    'final goodbye', 'last time', 'goodbye forever'
+]
+
+# Crisis levels, least severe first
+CRISIS_LEVELS = ['none', 'mild', 'moderate', 'severe']
+
+
+def contains_crisis_language(text):
+    """Cheap keyword check, usable before any model call"""
+    text_lower = (text or '').lower()
+    return any(indicator in text_lower for indicator in CRISIS_INDICATORS)
+
+
+def rollup_bucket_start(tier, ts):
+    """Start (epoch seconds, UTC) of the rollup bucket containing `ts`"""
+    ts = int(ts)
+    if tier == 'week':
+        # The epoch began on a Thursday; shift so weeks start on Monday
+        days = ts // 86400
+        return ((days + 3) // 7 * 7 - 3) * 86400
+    width = ROLLUP_TIERS[tier]['seconds']
+    return ts - ts % width
+
+
+def rollup_bucket_starts(tier, ts):
+    """Vectorized rollup_bucket_start for an int64 numpy array"""
+    if tier == 'week':
+        return ((ts // 86400 + 3) // 7 * 7 - 3) * 86400
+    width = ROLLUP_TIERS[tier]['seconds']
+    return ts - ts % width
 
-        # User mood history storage
-        self.user_mood_history = {}
+
+def _trend_date(start, resolution):
+    """Label of a trend point: ISO datetime for hourly buckets, ISO date otherwise"""
+    bucket_time = datetime.fromtimestamp(start, timezone.utc)
+    return bucket_time.isoformat() if resolution == 'hour' else bucket_time.date().isoformat()
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _estimate_history_bytes(history):
+    return sum(HISTORY_ENTRY_BYTES + len(entry['text']) for entry in history)
+
+
+def _estimate_rollup_bytes(rollups):
+    summaries = rollups.get('summaries', {}).values()
+    return (ROLLUP_BUCKET_BYTES * sum(len(rollups[tier]) for tier in ROLLUP_TIERS) +
+            sum(SUMMARY_BYTES + TREND_POINT_BYTES * len(summary['trend']) for summary in summaries))
+
+
+class ImportBaseline:
+    """Per-user state an import compares rows against, indexed by the file's user index"""
+
+    def __init__(self, user_count):
+        self.loaded = np.zeros(user_count, dtype=bool)
+        # Time range earlier imports covered; empty (inf, -inf) when there were none
+        self.range_first = np.full(user_count, np.inf)
+        self.range_last = np.full(user_count, -np.inf)
+        # Oldest history timestamp and (ts, score, emotion) keys of existing entries
+        self.history_first = np.full(user_count, np.inf)
+        self.history_keys = {}
+
+
+class GeminiMoodDetector:
+    def __init__(self, router=None):
+        # User mood history storage, evicted under the global memory budget
+        self.user_mood_history = UserStateStore('mood_history', _estimate_history_bytes)
+        # Per-user rollups: {tier: {bucket_start: [count, sum, min, max]}, 'version': n,
+        # 'imported_range': [first_ts, last_ts] covered by imports,
+        # 'summaries': {(days, resolution): memoized summary}}
+        self.user_mood_rollups = UserStateStore('mood_rollups', _estimate_rollup_bytes)
+        self._history_lock = threading.Lock()
+
+        # Versions come from one process-wide counter so a value is never reused,
+        # even for a user whose state was evicted and rebuilt
+        self._version_counter = itertools.count(1)
+        self.instance_id = os.urandom(4).hex()
 
         # Emotion-to-score mapping
         self.emotion_scores = {
@@ -45,10 +152,22 @@ class GeminiMoodDetector:
             'exhaustion': 3, 'fear': 3, 'nervousness': 4
         }
 
+        # Model calls go through the router; an injected one (e.g. with fake models) skips the API key check
+        self.router = router
+        self.api_key = os.getenv('GEMINI_API_KEY')
+        if self.router is not None:
+            return
+        if not self.api_key or self.api_key == 'your-gemini-api-key-here':
+            print("⚠️  GEMINI_API_KEY not configured - running in demo mode")
+            return
+
+        genai.configure(api_key=self.api_key)
+        self.router = get_default_router()
+
     def detect_mood(self, text):
         """Detect mood from text using Gemini API"""
         try:
-            if self.model is None:
+            if self.router is None:
                 # Demo mode
                 return {
                     'emotion': 'neutral',
@@ -75,7 +194,7 @@ Return a JSON object with:
 - crisis_indicators (optional)
 Respond ONLY in JSON.
 """
-            response = self.model.generate_content(prompt)
+            response = self.router.generate('mood_json', prompt)
 
             try:
                 mood_data = json.loads(response.text.strip())
@@ -121,6 +240,8 @@ Respond ONLY in JSON.
                 'error': None
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             return {
                 'emotion': 'neutral',
@@ -136,42 +257,121 @@ Respond ONLY in JSON.
             }
 
     def store_user_score(self, user_id, score, emotion, confidence, text=""):
-        """Store user's mood score in history"""
+        """Store user's mood score in history and update the rollups"""
+        now = datetime.now()
         entry = {
-        'timestamp': datetime.now().isoformat(),
-        'score': score,
-        'emotion': emotion,
-        'confidence': confidence,
-        'text': text
-    }
-
-        if user_id not in self.user_mood_history:
-            self.user_mood_history[user_id] = []
-
-        # Append instead of insert at 0
-        self.user_mood_history[user_id].append(entry)
-        
-        # Keep only last 100 entries
-        if len(self.user_mood_history[user_id]) > 100:
-            self.user_mood_history[user_id] = self.user_mood_history[user_id][-100:]
-
-    def get_mood_statistics(self, user_id, days=30):
-        """Get mood statistics for a user"""
-        if user_id not in self.user_mood_history:
-            return {'average_score': 5, 'min_score': 5, 'max_score': 5, 'total_entries': 0, 'trend': 'stable'}
+            'timestamp': now.isoformat(),
+            'score': score,
+            'emotion': emotion,
+            'confidence': confidence,
+            'text': text
+        }
 
-        cutoff_date = datetime.now() - timedelta(days=days)
-        recent_entries = [
-            entry for entry in self.user_mood_history[user_id]
-            if datetime.fromisoformat(entry['timestamp']) >= cutoff_date
-        ]
+        with self._history_lock:
+            # Keep only the most recent raw entries; long-range data lives in the rollups.
+            # Lists are replaced rather than mutated so evictions never see a partial write.
+            history = self.user_mood_history.get(user_id, [])
+            self.user_mood_history[user_id] = history[-(MAX_RAW_ENTRIES - 1):] + [entry]
+
+            self._update_rollups(user_id, now.timestamp(), score)
+
+    def _update_rollups(self, user_id, ts, score):
+        """Fold one score into the hour/day/week buckets of a user"""
+        rollups = self.user_mood_rollups.get(user_id) or {tier: {} for tier in ROLLUP_TIERS}
+        for tier in ROLLUP_TIERS:
+            buckets = rollups[tier]
+            start = rollup_bucket_start(tier, ts)
+            bucket = buckets.get(start)
+            if bucket is None:
+                buckets[start] = [1, score, score, score]
+                # Old buckets can only expire when a new one opens
+                cutoff = rollup_bucket_start(tier, ts - ROLLUP_TIERS[tier]['retention_days'] * 86400)
+                for expired in [key for key in buckets if key < cutoff]:
+                    del buckets[expired]
+            else:
+                bucket[0] += 1
+                bucket[1] += score
+                bucket[2] = min(bucket[2], score)
+                bucket[3] = max(bucket[3], score)
+        rollups['version'] = next(self._version_counter)
+        rollups['summaries'] = {}
+        self.user_mood_rollups[user_id] = rollups
+
+    def get_user_version(self, user_id):
+        """Version of a user's mood data; bumped by every write, 0 when there is none"""
+        rollups = self.user_mood_rollups.get(user_id)
+        return rollups['version'] if rollups else 0
+
+    def get_mood_summary_etag(self, user_id, days=30, resolution='day'):
+        """Validator for get_mood_summary.
+
+        Changes on every write for the user and whenever the window moves to a
+        new bucket, without computing the summary itself.
+        """
+        anchor = rollup_bucket_start('hour' if resolution == 'hour' else 'day', time.time())
+        return f"{self.instance_id}-{self.get_user_version(user_id)}-{anchor}-{days}-{resolution}"
+
+    def get_mood_summary(self, user_id, days=30, resolution='day'):
+        """Statistics and trend for a user, memoized until the ETag changes.
+
+        Memos live in the user's rollups entry, so they count against the
+        memory budget and are evicted together with the user.
+        """
+        etag = self.get_mood_summary_etag(user_id, days, resolution)
+        key = (days, resolution)
+        rollups = self.user_mood_rollups.get(user_id)
+        cached = rollups.get('summaries', {}).get(key) if rollups else None
+        if cached is not None and cached['etag'] == etag:
+            return cached
+
+        summary = {
+            'etag': etag,
+            'statistics': self.get_mood_statistics(user_id, days),
+            'trend': self.get_mood_trend(user_id, days, resolution),
+        }
+        with self._history_lock:
+            rollups = self.user_mood_rollups.get(user_id)
+            # Users without data are cheap to summarize and are not given an entry
+            if rollups and self.get_mood_summary_etag(user_id, days, resolution) == etag:
+                summaries = dict(rollups.get('summaries', {}))
+                summaries.pop(key, None)
+                summaries[key] = summary
+                while len(summaries) > MAX_SUMMARIES_PER_USER:
+                    del summaries[next(iter(summaries))]
+                rollups['summaries'] = summaries
+                self.user_mood_rollups[user_id] = rollups
+        return summary
+
+    def _get_rollup_buckets(self, user_id, tier, days):
+        """Return sorted (start, [count, sum, min, max]) buckets covering the last `days` days"""
+        cutoff = rollup_bucket_start(tier, time.time() - days * 86400)
+        with self._history_lock:
+            rollups = self.user_mood_rollups.get(user_id)
+            if not rollups:
+                return []
+            buckets = [(start, list(bucket)) for start, bucket in rollups[tier].items() if start >= cutoff]
+        return sorted(buckets)
 
-        if not recent_entries:
+    def get_mood_statistics(self, user_id, days=30):
+        """Get mood statistics for a user.
+
+        Aggregates come from the daily rollups, so the window is measured in
+        whole (UTC) days; the trend label compares the latest raw entries.
+        """
+        tier = 'day' if days <= ROLLUP_TIERS['day']['retention_days'] else 'week'
+        buckets = self._get_rollup_buckets(user_id, tier, days)
+        if not buckets:
             return {'average_score': 5, 'min_score': 5, 'max_score': 5, 'total_entries': 0, 'trend': 'stable'}
 
-        scores = [entry['score'] for entry in recent_entries]
+        total_entries = sum(bucket[0] for _, bucket in buckets)
+        total_score = sum(bucket[1] for _, bucket in buckets)
 
-        # Calculate trend
+        # Calculate trend from the last two weeks' worth of raw entries
+        cutoff_ts = buckets[0][0]
+        scores = [
+            entry['score'] for entry in self.user_mood_history.get(user_id, [])[-14:]
+            if datetime.fromisoformat(entry['timestamp']).timestamp() >= cutoff_ts
+        ]
         if len(scores) >= 7:
             recent_week = scores[-7:]
             older_week = scores[-14:-7] if len(scores) >= 14 else scores[:-7]
@@ -191,52 +391,245 @@ Respond ONLY in JSON.
             trend = 'stable'
 
         return {
-            'average_score': round(statistics.mean(scores), 2),
-            'min_score': min(scores),
-            'max_score': max(scores),
-            'total_entries': len(scores),
+            'average_score': round(total_score / total_entries, 2),
+            'min_score': min(bucket[2] for _, bucket in buckets),
+            'max_score': max(bucket[3] for _, bucket in buckets),
+            'total_entries': total_entries,
             'trend': trend
         }
 
-    def get_mood_trend(self, user_id, days=30):
-        """Get daily mood trend for charting"""
-        if user_id not in self.user_mood_history:
-            return []
-
-        daily_scores = {}
-        cutoff_date = datetime.now() - timedelta(days=days)
-
-        for entry in self.user_mood_history[user_id]:
-            entry_date = datetime.fromisoformat(entry['timestamp']).date()
-            if entry_date >= cutoff_date.date():
-                daily_scores.setdefault(entry_date, []).append(entry['score'])
+    def get_mood_trend(self, user_id, days=30, resolution='day'):
+        """Get mood trend for charting at hour, day or week resolution (UTC buckets)"""
+        if resolution not in ROLLUP_TIERS:
+            raise ValueError(f"Unknown resolution '{resolution}'")
+        if days > ROLLUP_TIERS[resolution]['retention_days']:
+            raise ValueError(f"'{resolution}' trends cover at most {ROLLUP_TIERS[resolution]['retention_days']} days")
 
         trend_data = []
-        for date in sorted(daily_scores.keys()):
-            avg_score = statistics.mean(daily_scores[date])
+        for start, (count, total, min_score, max_score) in self._get_rollup_buckets(user_id, resolution, days):
             trend_data.append({
-                'date': date.isoformat(),
-                'score': round(avg_score, 2),
-                'count': len(daily_scores[date])
+                'date': _trend_date(start, resolution),
+                'score': round(total / count, 2),
+                'count': count,
+                'min_score': min_score,
+                'max_score': max_score
             })
 
         return trend_data
 
-    def detect_significant_deviation(self, user_id, current_score, lookback_days=7, threshold_percentage=0.2):
-        """Detect if current score represents a significant deviation"""
-        if user_id not in self.user_mood_history:
-            return {'is_deviation': False, 'deviation_type': 'none', 'percentage_change': 0, 'average_score': current_score}
+    def summary_with_score(self, summary, score, resolution='day'):
+        """Copy of `summary` that also counts a score not yet stored.
+
+        Lets a caller answer with the write it just queued without waiting
+        for the pipeline; the trend label is left as computed.
+        """
+        stats = dict(summary['statistics'])
+        count = stats['total_entries']
+        stats['average_score'] = round((stats['average_score'] * count + score) / (count + 1), 2)
+        stats['min_score'] = score if count == 0 else min(stats['min_score'], score)
+        stats['max_score'] = score if count == 0 else max(stats['max_score'], score)
+        stats['total_entries'] = count + 1
+
+        trend = list(summary['trend'])
+        date = _trend_date(rollup_bucket_start(resolution, time.time()), resolution)
+        if trend and trend[-1]['date'] == date:
+            point = dict(trend[-1])
+            point['score'] = round((point['score'] * point['count'] + score) / (point['count'] + 1), 2)
+            point['count'] += 1
+            point['min_score'] = min(point['min_score'], score)
+            point['max_score'] = max(point['max_score'], score)
+            trend[-1] = point
+        else:
+            trend.append({'date': date, 'score': score, 'count': 1, 'min_score': score, 'max_score': score})
+
+        return {**summary, 'statistics': stats, 'trend': trend}
+
+    def export_history(self):
+        """Export every user's raw mood entries, resident or spilled.
+
+        Returns a ColumnarWriter; stream it with `iter_bytes()` and `close()`
+        it afterwards. Entry text is not exported. The export is lossy: only
+        the last MAX_RAW_ENTRIES entries per user exist as rows, so older
+        data held only in the rollups does not survive a round trip.
+        """
+        writer = ColumnarWriter()
+        for user_id, history in self.user_mood_history.items():
+            writer.add_user_rows(
+                user_id,
+                [int(datetime.fromisoformat(entry['timestamp']).timestamp()) for entry in history],
+                [entry['score'] for entry in history],
+                [str(entry['emotion']) for entry in history],
+                [_as_float(entry['confidence']) for entry in history],
+            )
+        return writer
+
+    def import_history(self, path, chunk_rows=IMPORT_CHUNK_ROWS):
+        """Rebuild history and rollups from a columnar file without calling the model.
+
+        The file is memory mapped and processed in chunks; each chunk is
+        grouped per user and bucket with numpy and merged into existing state.
+        A row is skipped when it falls within the time range earlier imports
+        covered for its user, or when the user's history already holds an
+        entry with the same (timestamp, score, emotion). Importing the same
+        file twice is a no-op, exported live entries are not counted twice,
+        and an older backfill still lands for users with newer live scores.
+        Returns (rows imported, rows skipped, users in the file).
+        """
+        with ColumnarFile(path) as source:
+            # Per-user baseline, taken from state as it was before this import touched the user
+            baseline = ImportBaseline(len(source.user_ids))
+            imported = 0
+            for start in range(0, source.rows, chunk_rows):
+                imported += self._import_chunk(source, start, min(start + chunk_rows, source.rows), baseline)
+            return imported, source.rows - imported, len(source.user_ids)
+
+    def _load_import_baseline(self, baseline, user_index, user_id):
+        rollups = self.user_mood_rollups.get(user_id)
+        imported_range = rollups.get('imported_range') if rollups else None
+        if imported_range:
+            baseline.range_first[user_index], baseline.range_last[user_index] = imported_range
+        history = self.user_mood_history.get(user_id) or []
+        keys = {
+            (int(datetime.fromisoformat(entry['timestamp']).timestamp()), float(entry['score']), str(entry['emotion']))
+            for entry in history
+        }
+        if keys:
+            baseline.history_keys[user_index] = keys
+            baseline.history_first[user_index] = min(key[0] for key in keys)
+        baseline.loaded[user_index] = True
+
+    def _import_chunk(self, source, start, stop, baseline):
+        users = source.columns['user'][start:stop].astype(np.int64)
+        ts = source.columns['ts'][start:stop].astype(np.int64)
+
+        for user_index in np.unique(users[~baseline.loaded[users]]).tolist():
+            self._load_import_baseline(baseline, user_index, source.user_ids[user_index])
+        keep = (ts < baseline.range_first[users]) | (ts > baseline.range_last[users])
+
+        # Only rows inside a user's history window can duplicate a history entry
+        candidates = np.flatnonzero(keep & (ts >= baseline.history_first[users]))
+        if len(candidates):
+            candidate_scores = source.columns['score'][start:stop][candidates].astype(np.float64).tolist()
+            candidate_emotions = source.columns['emotion'][start:stop][candidates].tolist()
+            for row, score, emotion_id in zip(candidates.tolist(), candidate_scores, candidate_emotions):
+                key = (int(ts[row]), score, source.emotions[emotion_id])
+                if key in baseline.history_keys[int(users[row])]:
+                    keep[row] = False
+
+        rows = np.flatnonzero(keep)
+        if not len(rows):
+            return 0
+        users, ts = users[rows], ts[rows]
+        scores = source.columns['score'][start:stop][rows].astype(np.float64)
+        if np.all(scores == np.floor(scores)):
+            # Whole scores stay ints so imported entries match live ones
+            scores = scores.astype(np.int64)
+        now = time.time()
+
+        # Rollups: aggregate per (user, bucket) for every tier within retention
+        rollup_updates = {}
+        for tier, config in ROLLUP_TIERS.items():
+            starts = rollup_bucket_starts(tier, ts)
+            keep = starts >= rollup_bucket_start(tier, now - config['retention_days'] * 86400)
+            tier_users, tier_starts, tier_scores = users[keep], starts[keep], scores[keep]
+            if not len(tier_users):
+                continue
+            order = np.lexsort((tier_starts, tier_users))
+            tier_users, tier_starts, tier_scores = tier_users[order], tier_starts[order], tier_scores[order]
+            first = np.flatnonzero(np.r_[
+                True, (tier_users[1:] != tier_users[:-1]) | (tier_starts[1:] != tier_starts[:-1])
+            ])
+            groups = zip(
+                tier_users[first].tolist(), tier_starts[first].tolist(),
+                np.diff(np.r_[first, len(tier_users)]).tolist(),
+                np.add.reduceat(tier_scores, first).tolist(),
+                np.minimum.reduceat(tier_scores, first).tolist(),
+                np.maximum.reduceat(tier_scores, first).tolist(),
+            )
+            for user_index, bucket_start, count, total, min_score, max_score in groups:
+                user_buckets = rollup_updates.setdefault(user_index, {}).setdefault(tier, {})
+                user_buckets[bucket_start] = [count, total, min_score, max_score]
+
+        # History: the latest MAX_RAW_ENTRIES rows of each user in this chunk
+        order = np.lexsort((ts, users))
+        sorted_users = users[order]
+        group_last = np.flatnonzero(np.r_[sorted_users[1:] != sorted_users[:-1], True])
+        row_group_last = np.repeat(group_last, np.diff(np.r_[-1, group_last]))
+        recent = order[row_group_last - np.arange(len(order)) < MAX_RAW_ENTRIES]
+
+        history_updates = {}
+        emotion_ids = source.columns['emotion'][start:stop][rows[recent]].tolist()
+        confidences = np.round(source.columns['confidence'][start:stop][rows[recent]].astype(np.float64), 4).tolist()
+        for user_index, entry_ts, score, emotion_id, confidence in zip(
+                users[recent].tolist(), ts[recent].tolist(), scores[recent].tolist(), emotion_ids, confidences):
+            history_updates.setdefault(user_index, []).append({
+                'timestamp': datetime.fromtimestamp(entry_ts).isoformat(),
+                'score': score,
+                'emotion': source.emotions[emotion_id],
+                'confidence': confidence,
+                'text': ''
+            })
 
+        # Rows are sorted by (user, ts), so each group's first and last rows bound its time range
+        group_first = np.r_[0, group_last[:-1] + 1]
+        range_updates = zip(sorted_users[group_last].tolist(), ts[order[group_first]].tolist(),
+                            ts[order[group_last]].tolist())
+        for user_index, first_ts, last_ts in range_updates:
+            self._merge_imported_user(
+                source.user_ids[user_index],
+                history_updates.get(user_index, []),
+                rollup_updates.get(user_index, {}),
+                first_ts, last_ts
+            )
+        return len(rows)
+
+    def _merge_imported_user(self, user_id, entries, tier_buckets, first_ts, last_ts):
+        with self._history_lock:
+            # History and rollups are evicted separately, so skip entries the history already holds
+            existing_history = self.user_mood_history.get(user_id, [])
+            seen = {entry['timestamp'] for entry in existing_history}
+            entries = [entry for entry in entries if entry['timestamp'] not in seen]
+            if entries:
+                history = existing_history + entries
+                history.sort(key=lambda entry: entry['timestamp'])
+                self.user_mood_history[user_id] = history[-MAX_RAW_ENTRIES:]
+
+            rollups = self.user_mood_rollups.get(user_id) or {tier: {} for tier in ROLLUP_TIERS}
+            for tier, buckets in tier_buckets.items():
+                existing = rollups[tier]
+                for bucket_start, (count, total, min_score, max_score) in buckets.items():
+                    bucket = existing.get(bucket_start)
+                    if bucket is None:
+                        existing[bucket_start] = [count, total, min_score, max_score]
+                    else:
+                        bucket[0] += count
+                        bucket[1] += total
+                        bucket[2] = min(bucket[2], min_score)
+                        bucket[3] = max(bucket[3], max_score)
+            rollups['version'] = next(self._version_counter)
+            # The range only grows through imports, so live writes never hide a backfill
+            imported_range = rollups.get('imported_range') or [first_ts, last_ts]
+            rollups['imported_range'] = [min(imported_range[0], first_ts), max(imported_range[1], last_ts)]
+            rollups['summaries'] = {}
+            self.user_mood_rollups[user_id] = rollups
+
+    def detect_significant_deviation(self, user_id, current_score, lookback_days=7, threshold_percentage=0.2,
+                                     pending_scores=None):
+        """Detect if current score represents a significant deviation.
+
+        `pending_scores` are earlier scores for the user that are queued but
+        not stored yet; they count as recent entries.
+        """
+        history = self.user_mood_history.get(user_id) or []
         cutoff_date = datetime.now() - timedelta(days=lookback_days)
-        recent_entries = [
-            entry for entry in self.user_mood_history[user_id]
+        recent_scores = [
+            entry['score'] for entry in history
             if datetime.fromisoformat(entry['timestamp']) >= cutoff_date
-        ]
+        ] + list(pending_scores or [])
 
-        if len(recent_entries) < 3:
+        if len(recent_scores) < 3:
             return {'is_deviation': False, 'deviation_type': 'none', 'percentage_change': 0, 'average_score': current_score}
 
-        recent_scores = [entry['score'] for entry in recent_entries]
         average_score = statistics.mean(recent_scores)
         percentage_change = abs(current_score - average_score) / average_score if average_score > 0 else 0
         is_deviation = percentage_change >= threshold_percentage
@@ -251,27 +644,66 @@ Respond ONLY in JSON.
             'average_score': round(average_score, 2)
         }
 
-    def should_trigger_emergency_alert(self, user_id, current_score, critical_threshold=2, drop_percentage=0.5):
+    def should_trigger_emergency_alert(self, user_id, current_score, critical_threshold=2, drop_percentage=0.5,
+                                       pending_scores=None):
         """Determine if emergency alert should be triggered"""
         if current_score <= critical_threshold:
             return True
-        deviation = self.detect_significant_deviation(user_id, current_score)
+        deviation = self.detect_significant_deviation(user_id, current_score, pending_scores=pending_scores)
         return deviation['is_deviation'] and deviation['deviation_type'] == 'decline' and deviation['percentage_change'] >= drop_percentage * 100
 
-    def detect_crisis_situation(self, text, mood_analysis=None):
-        """Detect if the text indicates a crisis situation"""
+    def detect_crisis_situation(self, text, mood_analysis=None, enrich=False):
+        """Detect if the text indicates a crisis situation.
+
+        With `enrich`, text already flagged is also assessed by the model
+        ('crisis_enrichment' task). The model can raise the crisis level but
+        never lower it, and a failed or late call keeps the keyword result.
+        """
+        detection = self._detect_crisis_keywords(text, mood_analysis)
+        if enrich and detection['is_crisis'] and self.router is not None:
+            try:
+                self._enrich_crisis_detection(text, detection)
+            except DeadlineExceeded:
+                pass
+            except Exception as e:
+                detection['enrichment_error'] = str(e)
+        return detection
+
+    def _enrich_crisis_detection(self, text, detection):
+        prompt = f"""
+You are a mental health crisis triage assistant. This message was flagged for possible crisis language:
+"{text}"
+
+Return a JSON object with:
+- crisis_level (none, mild, moderate, severe)
+- indicators (list of short phrases)
+- recommended_action (one sentence)
+Respond ONLY in JSON.
+"""
+        response = self.router.generate('crisis_enrichment', prompt)
         try:
-            crisis_indicators = [
-                'suicide', 'kill myself', 'end it all', 'not worth living',
-                'better off dead', 'want to die', 'hurt myself', 'self harm',
-                'cut myself', 'overdose', 'jump off', 'hang myself',
-                'no point', 'hopeless', "can't go on", 'give up',
-                'nobody cares', 'alone forever', 'worthless', 'burden',
-                'final goodbye', 'last time', 'goodbye forever'
-            ]
+            assessment = json.loads(response.text.strip())
+        except json.JSONDecodeError:
+            assessment = {}
 
+        model_level = str(assessment.get('crisis_level', 'none')).lower()
+        model_indicators = assessment.get('indicators') or []
+        if model_level not in CRISIS_LEVELS or not isinstance(model_indicators, list):
+            return
+        detection['enrichment'] = {
+            'crisis_level': model_level,
+            'indicators': model_indicators,
+            'recommended_action': assessment.get('recommended_action'),
+        }
+        if CRISIS_LEVELS.index(model_level) > CRISIS_LEVELS.index(detection['crisis_level']):
+            detection['crisis_level'] = model_level
+            detection['requires_immediate_intervention'] = model_level in ['severe', 'moderate']
+        detection['all_indicators'] = detection['all_indicators'] + model_indicators
+
+    def _detect_crisis_keywords(self, text, mood_analysis=None):
+        try:
             text_lower = text.lower()
-            found_indicators = [i for i in crisis_indicators if i in text_lower]
+            found_indicators = [i for i in CRISIS_INDICATORS if i in text_lower]
             mood_crisis_indicators = mood_analysis.get('crisis_indicators', []) if mood_analysis else []
 
             crisis_level = 'none'
@@ -0,0 +1,262 @@
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import google.generativeai as genai
+
+from deadlines import DeadlineExceeded, check_deadline, remaining_time
+from sampling_profiler import get_default_profiler
+
+# Model tiers, fastest first. A tier whose rolling p95 latency exceeds its
+# budget hands its traffic to the next faster tier until it recovers.
+DEFAULT_TIERS = {
+    'fast': {'model': 'gemini-2.0-flash-lite', 'latency_budget': 3.0},
+    'standard': {'model': 'gemini-2.0-flash', 'latency_budget': 8.0},
+}
+
+# Task -> tier, output token cap and whether slow calls are hedged
+DEFAULT_TASKS = {
+    'mood_json': {'tier': 'fast', 'max_output_tokens': 256, 'hedge': False},
+    'chat_reply': {'tier': 'standard', 'max_output_tokens': 512},
+    'crisis_enrichment': {'tier': 'standard', 'max_output_tokens': 256},
+    'coping_generation': {'tier': 'standard', 'max_output_tokens': 512},
+}
+
+# Rolling latency window per tier, and samples needed before it is trusted
+LATENCY_WINDOW_SECONDS = 300
+LATENCY_WINDOW_SIZE = 200
+MIN_LATENCY_SAMPLES = 20
+
+# A hedged task sends its second request once the first outlasts this percentile
+HEDGE_PERCENTILE = 0.9
+
+# Per-request list collecting the wall time (seconds) of each generate() call
+_model_call_log = contextvars.ContextVar('model_call_log', default=None)
+
+
+def start_model_call_log():
+    """Collect model call latencies for the current context; returns (log, token)"""
+    log = []
+    return log, _model_call_log.set(log)
+
+
+def stop_model_call_log(token):
+    _model_call_log.reset(token)
+
+
+def _load_config(env_name, defaults):
+    """Defaults overlaid with a JSON object from the environment"""
+    config = {name: dict(values) for name, values in defaults.items()}
+    overrides = os.getenv(env_name)
+    if overrides:
+        for name, values in json.loads(overrides).items():
+            config.setdefault(name, {}).update(values)
+    return config
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class ModelRouter:
+    """Routes each model task to a configured tier with latency-aware fallback.
+
+    `model_factory(model_name)` must return an object with a Gemini-style
+    `generate_content(prompt, generation_config=...)`; pass a fake one to run
+    without the API.
+
+    Calls made under a request deadline run on a worker pool so the caller
+    stops waiting when the deadline passes; the abandoned call finishes in
+    the background and is discarded.
+    """
+
+    def __init__(self, tiers=None, tasks=None, model_factory=None, max_workers=None):
+        self.tiers = tiers or _load_config('MODEL_ROUTER_TIERS', DEFAULT_TIERS)
+        self.tasks = tasks or _load_config('MODEL_ROUTER_TASKS', DEFAULT_TASKS)
+        self.model_factory = model_factory or genai.GenerativeModel
+        self._tier_order = list(self.tiers)
+        self._models = {}
+        self._latencies = {tier: deque(maxlen=LATENCY_WINDOW_SIZE) for tier in self.tiers}
+        self._lock = threading.Lock()
+        self._decisions = {task: {} for task in self.tasks}
+        self._tier_metrics = {tier: {'calls': 0, 'errors': 0, 'fallbacks': 0} for tier in self.tiers}
+        self._call_metrics = {'hedges_sent': 0, 'hedges_won': 0, 'deadline_exceeded': 0}
+        self.profiler = get_default_profiler()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv('MODEL_CALL_WORKERS', 32)),
+            thread_name_prefix='model-call'
+        )
+
+    def generate(self, task, prompt):
+        """Run `prompt` for `task` on the routed tier and return the model response.
+
+        Raises DeadlineExceeded once the current request deadline passes. For
+        tasks configured with `hedge`, a second request is sent when the first
+        is slower than the tier's observed p90 and the first answer wins.
+        """
+        check_deadline()
+        started = time.monotonic()
+        try:
+            return self._generate(task, prompt)
+        finally:
+            log = _model_call_log.get()
+            if log is not None:
+                log.append(time.monotonic() - started)
+
+    def _generate(self, task, prompt):
+        task_config = self.tasks[task]
+        tier = self.route(task)
+        remaining = remaining_time()
+        hedge_delay = self._hedge_delay(tier) if task_config.get('hedge') else None
+        if remaining is None and hedge_delay is None:
+            return self._call(tier, prompt, task_config)
+
+        futures = [self._submit(tier, prompt, task_config)]
+        if hedge_delay is not None and (remaining is None or hedge_delay < remaining):
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                futures.append(self._submit(tier, prompt, task_config))
+                with self._lock:
+                    self._call_metrics['hedges_sent'] += 1
+        return self._first_result(futures)
+
+    def route(self, task):
+        """Pick the tier for a task, falling back to faster tiers over budget"""
+        configured = self.tasks[task]['tier']
+        tier = configured
+        index = self._tier_order.index(configured)
+        while index > 0 and self._over_budget(tier):
+            index -= 1
+            tier = self._tier_order[index]
+
+        with self._lock:
+            self._decisions[task][tier] = self._decisions[task].get(tier, 0) + 1
+            self._tier_metrics[tier]['calls'] += 1
+            if tier != configured:
+                self._tier_metrics[configured]['fallbacks'] += 1
+        return tier
+
+    def record_latency(self, tier, seconds):
+        with self._lock:
+            self._latencies[tier].append((time.monotonic(), seconds))
+
+    def tier_latencies(self, tier):
+        """Latencies (seconds) observed for a tier within the rolling window"""
+        cutoff = time.monotonic() - LATENCY_WINDOW_SECONDS
+        with self._lock:
+            samples = self._latencies[tier]
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            return [seconds for _, seconds in samples]
+
+    def get_metrics(self):
+        tiers = {}
+        for tier, config in self.tiers.items():
+            latencies = self.tier_latencies(tier)
+            with self._lock:
+                counters = dict(self._tier_metrics[tier])
+            tiers[tier] = {
+                'model': config['model'],
+                'latency_budget_ms': round(config['latency_budget'] * 1000, 1),
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+                'samples': len(latencies),
+                'over_budget': self._over_budget(tier),
+                **counters,
+            }
+        with self._lock:
+            decisions = {task: dict(counts) for task, counts in self._decisions.items()}
+            calls = dict(self._call_metrics)
+        return {'tiers': tiers, 'decisions': decisions, **calls}
+
+    def _submit(self, tier, prompt, task_config):
+        # Run in a copy of the caller's context so per-request state follows the call
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._call, tier, prompt, task_config)
+
+    def _call(self, tier, prompt, task_config):
+        model = self._get_model(tier)
+        started = time.monotonic()
+        # Worker threads are profiled along with the request that submitted the call
+        profile_token = self.profiler.begin()
+        try:
+            return model.generate_content(
+                prompt,
+                generation_config={'max_output_tokens': task_config['max_output_tokens']}
+            )
+        except Exception:
+            with self._lock:
+                self._tier_metrics[tier]['errors'] += 1
+            raise
+        finally:
+            self.profiler.end(profile_token)
+            self.record_latency(tier, time.monotonic() - started)
+
+    def _first_result(self, futures):
+        """First successful result among `futures`, bounded by the request deadline"""
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=remaining_time(), return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.cancel()
+                with self._lock:
+                    self._call_metrics['deadline_exceeded'] += 1
+                raise DeadlineExceeded('model call exceeded the request deadline')
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is not futures[0]:
+                        with self._lock:
+                            self._call_metrics['hedges_won'] += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _hedge_delay(self, tier):
+        latencies = self.tier_latencies(tier)
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return percentile(latencies, HEDGE_PERCENTILE)
+
+    def _over_budget(self, tier):
+        latencies = self.tier_latencies(tier)
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return False
+        return percentile(latencies, 0.95) > self.tiers[tier]['latency_budget']
+
+    def _get_model(self, tier):
+        with self._lock:
+            if tier not in self._models:
+                self._models[tier] = self.model_factory(self.tiers[tier]['model'])
+            return self._models[tier]
+
+
+_default_router = None
+_default_router_lock = threading.Lock()
+
+
+def set_default_router(router):
+    """Replace the process-wide router (e.g. with fake models for load replay)"""
+    global _default_router
+    with _default_router_lock:
+        _default_router = router
+    return router
+
+
+def get_default_router():
+    """Process-wide router shared by the chatbot and mood detector"""
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = ModelRouter()
+        return _default_router
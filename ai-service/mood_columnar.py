@@ -0,0 +1,214 @@
+"""Compact columnar file format for bulk mood history transfer.
+
+Layout (little-endian, every section aligned to 8 bytes):
+
+    header     magic, version, rows, user count, emotion count and the
+               byte offsets of the two string tables and the first column
+    users      string table of user ids
+    emotions   string table of emotion names
+    columns    one contiguous array per column, in COLUMNS order
+
+A string table is `count + 1` uint32 end offsets followed by the UTF-8 blob.
+Columns are plain fixed-width arrays, so a file can be memory mapped and
+read as numpy views without copying or parsing.
+"""
+import mmap
+import struct
+import tempfile
+
+import numpy as np
+
+MAGIC = b'MOODCOL1'
+FORMAT_VERSION = 1
+
+# magic, version, rows, users, emotions, users offset, emotions offset, columns offset
+HEADER = struct.Struct('<8sIQIIQQQ')
+
+COLUMNS = [
+    ('user', np.dtype('<u4')),
+    ('ts', np.dtype('<i8')),
+    ('score', np.dtype('<f4')),
+    ('emotion', np.dtype('<u2')),
+    ('confidence', np.dtype('<f4')),
+]
+
+COPY_CHUNK_BYTES = 1 << 20
+
+# Accepted `ts` range (epoch seconds): 1970 up to the last day of year 9999
+MIN_TIMESTAMP = 0
+MAX_TIMESTAMP = 253402214400
+
+
+class ColumnarFormatError(ValueError):
+    """Raised for files that are not valid mood columnar files"""
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _padding(offset):
+    return b'\0' * (_align(offset) - offset)
+
+
+def _encode_string_table(strings):
+    blobs = [value.encode('utf-8') for value in strings]
+    ends = np.cumsum([0] + [len(blob) for blob in blobs], dtype='<u4')
+    table = ends.tobytes() + b''.join(blobs)
+    return table + _padding(len(table))
+
+
+def _decode_string_table(buffer, offset, count, name):
+    """Strings of the table at `offset`; raises ColumnarFormatError when it is malformed"""
+    blob_start = offset + 4 * (count + 1)
+    if blob_start > len(buffer):
+        raise ColumnarFormatError(f'{name} table is out of bounds')
+    ends = np.frombuffer(buffer, dtype='<u4', count=count + 1, offset=offset).astype(np.int64)
+    if ends[0] != 0 or (np.diff(ends) < 0).any():
+        raise ColumnarFormatError(f'{name} table offsets are not increasing')
+    if blob_start + int(ends[-1]) > len(buffer):
+        raise ColumnarFormatError(f'{name} table is out of bounds')
+    blob = bytes(buffer[blob_start:blob_start + int(ends[-1])])
+    ends = ends.tolist()
+    try:
+        return [blob[ends[i]:ends[i + 1]].decode('utf-8') for i in range(count)]
+    except UnicodeDecodeError:
+        raise ColumnarFormatError(f'{name} table is not valid UTF-8')
+
+
+def _column_offsets(columns_offset, rows):
+    offsets = {}
+    offset = columns_offset
+    for name, dtype in COLUMNS:
+        offsets[name] = offset
+        offset = _align(offset + rows * dtype.itemsize)
+    return offsets
+
+
+class ColumnarWriter:
+    """Accumulates rows column by column in temporary files.
+
+    Memory use stays bounded by the string tables; `iter_bytes` then streams
+    the finished file so it can be written to disk or sent as a response.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self._user_ids = {}
+        self._emotions = {}
+        self._spools = {name: tempfile.TemporaryFile() for name, _ in COLUMNS}
+
+    def add_user_rows(self, user_id, timestamps, scores, emotions, confidences):
+        """Append one user's rows; all sequences must have the same length"""
+        if not timestamps:
+            return
+        user_index = self._user_ids.setdefault(user_id, len(self._user_ids))
+        emotion_ids = [self._emotions.setdefault(emotion, len(self._emotions)) for emotion in emotions]
+        values = {
+            'user': np.full(len(timestamps), user_index),
+            'ts': timestamps,
+            'score': scores,
+            'emotion': emotion_ids,
+            'confidence': confidences,
+        }
+        for name, dtype in COLUMNS:
+            self._spools[name].write(np.asarray(values[name], dtype=dtype).tobytes())
+        self.rows += len(timestamps)
+
+    def iter_bytes(self):
+        """Yield the complete file in chunks"""
+        users_table = _encode_string_table(list(self._user_ids))
+        emotions_table = _encode_string_table(list(self._emotions))
+        users_offset = _align(HEADER.size)
+        emotions_offset = users_offset + len(users_table)
+        columns_offset = emotions_offset + len(emotions_table)
+
+        yield HEADER.pack(
+            MAGIC, FORMAT_VERSION, self.rows, len(self._user_ids), len(self._emotions),
+            users_offset, emotions_offset, columns_offset
+        ) + _padding(HEADER.size)
+        yield users_table
+        yield emotions_table
+
+        for name, dtype in COLUMNS:
+            spool = self._spools[name]
+            spool.seek(0)
+            while True:
+                chunk = spool.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+            yield _padding(self.rows * dtype.itemsize)
+
+    def close(self):
+        for spool in self._spools.values():
+            spool.close()
+
+
+class ColumnarFile:
+    """Memory-mapped reader; `columns` holds zero-copy numpy views"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ColumnarFormatError('file is empty')
+
+        if len(self._mmap) < HEADER.size:
+            self.close()
+            raise ColumnarFormatError('file is too short')
+        (magic, version, self.rows, user_count, emotion_count,
+         users_offset, emotions_offset, columns_offset) = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ColumnarFormatError('not a mood columnar file')
+
+        offsets = _column_offsets(columns_offset, self.rows)
+        last_name, last_dtype = COLUMNS[-1]
+        if offsets[last_name] + self.rows * last_dtype.itemsize > len(self._mmap):
+            self.close()
+            raise ColumnarFormatError('file is truncated')
+
+        try:
+            self.user_ids = _decode_string_table(self._mmap, users_offset, user_count, 'users')
+            self.emotions = _decode_string_table(self._mmap, emotions_offset, emotion_count, 'emotions')
+        except ColumnarFormatError:
+            self.close()
+            raise
+        self.columns = {
+            name: np.frombuffer(self._mmap, dtype=dtype, count=self.rows, offset=offsets[name])
+            for name, dtype in COLUMNS
+        }
+        error = self._validate(user_count, emotion_count)
+        if error:
+            self.close()
+            raise ColumnarFormatError(error)
+
+    def _validate(self, user_count, emotion_count):
+        """Reason the column values are unusable, checked before anything reads them"""
+        if not self.rows:
+            return None
+        columns = self.columns
+        if int(columns['user'].max()) >= user_count:
+            return 'user index out of range'
+        if int(columns['emotion'].max()) >= emotion_count:
+            return 'emotion index out of range'
+        if int(columns['ts'].min()) < MIN_TIMESTAMP or int(columns['ts'].max()) > MAX_TIMESTAMP:
+            return 'timestamp out of range'
+        if not (np.isfinite(columns['score']).all() and np.isfinite(columns['confidence']).all()):
+            return 'non-finite score or confidence'
+        return None
+
+    def close(self):
+        # Views must be released before the map can be closed
+        self.columns = {}
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,245 @@
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from deadlines import remaining_time
+from sampling_profiler import get_default_profiler
+
+_STOP = object()
+
+
+class MoodPipeline:
+    """Background post-processing for mood writes.
+
+    History persistence and statistics/trend refresh run on worker threads
+    after the response has been sent. Jobs are sharded by user id so each
+    user's writes are applied in the order they arrived. Alerts are sent from
+    a separate bounded pool so a slow listener never holds up writes.
+    """
+
+    def __init__(self, mood_detector, num_workers=None, max_queue_size=None, summary_days=30,
+                 submit_timeout=None, alert_workers=None, max_pending_alerts=None):
+        self.mood_detector = mood_detector
+        self.num_workers = max(1, num_workers or int(os.getenv('MOOD_PIPELINE_WORKERS', 2)))
+        self.max_queue_size = max_queue_size or int(os.getenv('MOOD_PIPELINE_QUEUE_SIZE', 1000))
+        self.summary_days = summary_days
+        # Longest a producer waits on a full shard before writing inline
+        self.submit_timeout = submit_timeout or float(os.getenv('MOOD_PIPELINE_SUBMIT_TIMEOUT', 1.0))
+        self.max_pending_alerts = max_pending_alerts or int(os.getenv('MOOD_ALERT_QUEUE_SIZE', 1000))
+        self._alert_executor = ThreadPoolExecutor(
+            max_workers=alert_workers or int(os.getenv('MOOD_ALERT_WORKERS', 2)),
+            thread_name_prefix='mood-alert'
+        )
+        self._pending_alerts = set()
+        # Scores submitted but not yet stored, per user, in submission order
+        self._pending_scores = {}
+
+        self._queues = [queue.Queue(maxsize=self.max_queue_size) for _ in range(self.num_workers)]
+        self._threads = []
+        self._alert_listeners = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self.profiler = get_default_profiler()
+        self._metrics = {
+            'submitted': 0,
+            'processed': 0,
+            'failed': 0,
+            'blocked_submits': 0,
+            'blocked_seconds': 0.0,
+            'inline_writes': 0,
+            'alerts_dispatched': 0,
+            'alerts_dropped': 0,
+            'max_queue_depth': 0,
+        }
+
+    def start(self):
+        """Start the worker threads"""
+        for index, work_queue in enumerate(self._queues):
+            thread = threading.Thread(
+                target=self._worker, args=(work_queue,),
+                name=f'mood-pipeline-{index}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def add_alert_listener(self, listener):
+        """Register a callable(user_id, alert) invoked for every raised alert"""
+        self._alert_listeners.append(listener)
+
+    def submit(self, user_id, mood_analysis, text='', deviation_analysis=None, emergency_triggered=False):
+        """Queue post-processing for a scored message.
+
+        While the user's shard is full the producer waits, at most until the
+        request deadline or `submit_timeout`, and then stores the score
+        inline so no write is lost. Once the pipeline is shut down jobs run
+        inline.
+        """
+        job = {
+            'user_id': user_id,
+            'mood_analysis': mood_analysis,
+            'text': text,
+            'deviation_analysis': deviation_analysis,
+            'emergency_triggered': emergency_triggered,
+        }
+        with self._lock:
+            self._pending_scores.setdefault(user_id, []).append(mood_analysis['score'])
+
+        if self._closed or not self._threads:
+            self._process(job)
+            return
+
+        work_queue = self._queues[zlib.crc32(str(user_id).encode('utf-8')) % self.num_workers]
+        try:
+            work_queue.put_nowait(job)
+        except queue.Full:
+            started = time.monotonic()
+            remaining = remaining_time()
+            timeout = self.submit_timeout if remaining is None else min(self.submit_timeout, remaining)
+            try:
+                if timeout <= 0:
+                    raise queue.Full
+                work_queue.put(job, timeout=timeout)
+            except queue.Full:
+                with self._lock:
+                    self._metrics['inline_writes'] += 1
+                self._process(job)
+            with self._lock:
+                self._metrics['blocked_submits'] += 1
+                self._metrics['blocked_seconds'] += time.monotonic() - started
+
+        with self._lock:
+            self._metrics['submitted'] += 1
+            depth = self.queue_depth()
+            if depth > self._metrics['max_queue_depth']:
+                self._metrics['max_queue_depth'] = depth
+
+    def pending_scores(self, user_id):
+        """Scores submitted for a user that have not been stored yet"""
+        with self._lock:
+            return list(self._pending_scores.get(user_id, ()))
+
+    def get_summary(self, user_id):
+        """Return the statistics/trend summary for the writes processed so far.
+
+        The workers refresh the detector's memoized summary after each write,
+        so this is normally a cache hit.
+        """
+        return self.mood_detector.get_mood_summary(user_id, self.summary_days)
+
+    def queue_depth(self):
+        """Number of jobs waiting across all shards"""
+        return sum(work_queue.qsize() for work_queue in self._queues)
+
+    def get_metrics(self):
+        """Pipeline counters for the metrics endpoint"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics['blocked_seconds'] = round(metrics['blocked_seconds'], 3)
+        metrics['queue_depth'] = self.queue_depth()
+        metrics['pending_alerts'] = len(self._pending_alerts)
+        metrics['workers'] = self.num_workers
+        metrics['max_queue_size'] = self.max_queue_size
+        return metrics
+
+    def shutdown(self, timeout=10):
+        """Stop accepting background work and drain what is already queued"""
+        if self._closed:
+            return
+        self._closed = True
+        for work_queue in self._queues:
+            work_queue.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        wait(list(self._pending_alerts), timeout=max(0, deadline - time.monotonic()))
+        self._alert_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _worker(self, work_queue):
+        while True:
+            job = work_queue.get()
+            try:
+                if job is _STOP:
+                    return
+                self._process(job)
+            finally:
+                work_queue.task_done()
+
+    def _process(self, job):
+        with self.profiler.track('mood-pipeline'):
+            self._process_job(job)
+
+    def _process_job(self, job):
+        user_id = job['user_id']
+        mood_analysis = job['mood_analysis']
+        try:
+            try:
+                self.mood_detector.store_user_score(
+                    user_id=user_id,
+                    score=mood_analysis['score'],
+                    emotion=mood_analysis['emotion'],
+                    confidence=mood_analysis['confidence'],
+                    text=job['text']
+                )
+            finally:
+                self._remove_pending_score(user_id)
+            self.mood_detector.get_mood_summary(user_id, self.summary_days)
+            self._dispatch_alerts(job)
+            with self._lock:
+                self._metrics['processed'] += 1
+        except Exception as e:
+            with self._lock:
+                self._metrics['failed'] += 1
+            print(f"❌ Mood pipeline job failed: {e}")
+
+    def _remove_pending_score(self, user_id):
+        with self._lock:
+            scores = self._pending_scores.get(user_id)
+            if scores:
+                scores.pop(0)
+                if not scores:
+                    del self._pending_scores[user_id]
+
+    def _dispatch_alerts(self, job):
+        deviation = job['deviation_analysis'] or {}
+        is_decline = deviation.get('is_deviation') and deviation.get('deviation_type') == 'decline'
+        if not (job['emergency_triggered'] or is_decline):
+            return
+
+        alert = {
+            'userId': job['user_id'],
+            'emergencyTriggered': job['emergency_triggered'],
+            'deviationAnalysis': job['deviation_analysis'],
+            'score': job['mood_analysis']['score'],
+            'emotion': job['mood_analysis']['emotion'],
+        }
+        for listener in self._alert_listeners:
+            with self._lock:
+                if len(self._pending_alerts) >= self.max_pending_alerts:
+                    self._metrics['alerts_dropped'] += 1
+                    print("❌ Mood alert dropped: too many alerts pending")
+                    continue
+            try:
+                future = self._alert_executor.submit(self._send_alert, listener, job['user_id'], alert)
+            except RuntimeError:
+                # Executor already shut down; deliver on this thread
+                self._send_alert(listener, job['user_id'], alert)
+                continue
+            with self._lock:
+                self._pending_alerts.add(future)
+            future.add_done_callback(self._alert_done)
+
+    def _alert_done(self, future):
+        with self._lock:
+            self._pending_alerts.discard(future)
+
+    def _send_alert(self, listener, user_id, alert):
+        try:
+            listener(user_id, alert)
+            with self._lock:
+                self._metrics['alerts_dispatched'] += 1
+        except Exception as e:
+            print(f"❌ Mood alert listener failed: {e}")
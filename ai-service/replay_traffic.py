@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Replay a captured traffic trace against a running AI service.
+
+Start the service under test with AI_REPLAY_MODE=1 so model calls sleep for
+the recorded latencies instead of calling Gemini, then run:
+
+    python replay_traffic.py trace.jsonl --speed 2 --output new.json
+    python replay_traffic.py trace.jsonl --compare new.json
+
+Requests are sent open-loop at their recorded offsets divided by --speed,
+with synthetic text of the recorded length. The report has p50/p95/p99
+latency and throughput overall and per route. Latency is measured from
+each request's scheduled send time, so time spent waiting for a free
+client counts against the service (no coordinated omission); the
+`service_*` percentiles measure from the actual send only.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from model_router import percentile
+from traffic_capture import REPLAY_LATENCY_HEADER, TRACED_ROUTES
+
+FILLER = 'lorem ipsum dolor sit amet '
+CRISIS_PHRASE = 'hopeless '
+
+
+def load_trace(path):
+    """Trace records sorted by start time; malformed lines are skipped"""
+    records = []
+    with open(path, encoding='utf-8') as trace_file:
+        for line in trace_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('route') in TRACED_ROUTES and 'start' in record:
+                records.append(record)
+    records.sort(key=lambda record: record['start'])
+    return records
+
+
+def synthetic_text(length, crisis=False):
+    """Neutral text of `length` characters, led by a crisis phrase when the original had one"""
+    prefix = CRISIS_PHRASE if crisis else ''
+    length = max(length, len(prefix), 1)
+    body = FILLER * (length // len(FILLER) + 1)
+    return (prefix + body)[:length]
+
+
+def build_request(record):
+    """Request body and headers reproducing a trace record"""
+    text = synthetic_text(record.get('text_len', 0), record.get('crisis', False))
+    body = {TRACED_ROUTES[record['route']]: text}
+    if record.get('user'):
+        body['userId'] = f"replay-{record['user']}"
+    headers = {REPLAY_LATENCY_HEADER: ','.join(str(ms) for ms in record.get('model_ms', []))}
+    return body, headers
+
+
+class Replayer:
+    def __init__(self, target, speed=1.0, concurrency=64, timeout_ms=None):
+        self.target = target.rstrip('/')
+        self.speed = speed
+        self.concurrency = concurrency
+        self.timeout_ms = timeout_ms
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.results = []
+
+    def run(self, records):
+        """Send every record at its scaled offset and return the report"""
+        self.results = []
+        if not records:
+            return self.report(0.0)
+
+        first_start = records[0]['start']
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for record in records:
+                scheduled = started + (record['start'] - first_start) / self.speed
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self._send, record, scheduled)
+        return self.report(time.monotonic() - started)
+
+    def report(self, duration):
+        results = list(self.results)
+        routes = {}
+        for route in TRACED_ROUTES:
+            route_results = [result for result in results if result['route'] == route]
+            if route_results:
+                routes[route] = self._summarize(route_results, duration)
+        return {
+            'target': self.target,
+            'speed': self.speed,
+            'duration_s': round(duration, 2),
+            **self._summarize(results, duration),
+            'status_codes': dict(Counter(str(result['status']) for result in results)),
+            'dispatch_lag_p99_ms': self._percentile_ms([result['lag'] for result in results], 0.99),
+            'routes': routes,
+        }
+
+    def _send(self, record, scheduled):
+        body, headers = build_request(record)
+        if self.timeout_ms:
+            headers['X-Request-Timeout-Ms'] = str(self.timeout_ms)
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+
+        sent = time.monotonic()
+        try:
+            response = session.post(self.target + record['route'], json=body, headers=headers, timeout=60)
+            status = response.status_code
+        except requests.RequestException:
+            status = 'error'
+        finished = time.monotonic()
+        result = {
+            'route': record['route'],
+            'status': status,
+            'latency': finished - scheduled,
+            'service_latency': finished - sent,
+            'lag': sent - scheduled,
+        }
+        with self._lock:
+            self.results.append(result)
+
+    def _summarize(self, results, duration):
+        latencies = [result['latency'] for result in results]
+        service_latencies = [result['service_latency'] for result in results]
+        return {
+            'requests': len(results),
+            'errors': sum(1 for result in results if result['status'] == 'error' or result['status'] >= 400),
+            'throughput_rps': round(len(results) / duration, 2) if duration > 0 else None,
+            'p50_ms': self._percentile_ms(latencies, 0.5),
+            'p95_ms': self._percentile_ms(latencies, 0.95),
+            'p99_ms': self._percentile_ms(latencies, 0.99),
+            'service_p50_ms': self._percentile_ms(service_latencies, 0.5),
+            'service_p99_ms': self._percentile_ms(service_latencies, 0.99),
+        }
+
+    @staticmethod
+    def _percentile_ms(values, fraction):
+        return round(percentile(values, fraction) * 1000, 1) if values else None
+
+
+def _delta(new, old):
+    if new is None or old is None:
+        return 'n/a'
+    change = f" ({(new - old) / old * 100:+.1f}%)" if old else ''
+    return f"{old} -> {new}{change}"
+
+
+def print_comparison(report, baseline):
+    """Print p99 (from scheduled send time) and throughput of `report` against a `baseline` report"""
+    print("📊 Compared with baseline")
+    rows = [('all', report, baseline)]
+    rows += [(route, report['routes'][route], baseline['routes'].get(route, {})) for route in report['routes']]
+    for name, new, old in rows:
+        print(f"  {name:<16} p99_ms {_delta(new.get('p99_ms'), old.get('p99_ms'))}")
+        print(f"  {'':<16} rps    {_delta(new.get('throughput_rps'), old.get('throughput_rps'))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a captured AI service traffic trace')
+    parser.add_argument('trace', help='JSON lines trace written via AI_TRACE_FILE')
+    parser.add_argument('--target', default='http://localhost:5001', help='AI service base URL')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed multiplier (2 = twice as fast)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Maximum requests in flight')
+    parser.add_argument('--timeout-ms', type=int, help='Send this request deadline with every request')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--compare', help='Baseline JSON report to compare against')
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        parser.error('--speed must be positive')
+
+    records = load_trace(args.trace)
+    print(f"▶️  Replaying {len(records)} requests against {args.target} at {args.speed}x")
+    report = Replayer(args.target, args.speed, args.concurrency, args.timeout_ms).run(records)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            print_comparison(report, json.load(baseline_file))
+    return 0 if records else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""On-demand stack sampling profiler.
+
+Profiling is off by default. Once started, a sampler thread periodically
+reads the stacks of threads that are handling a sampled request (or a
+background job) and counts them per label. Output uses the collapsed stack
+format understood by flamegraph.pl and speedscope:
+
+    /chat;chat (app.py:170);detect_mood (gemini_mood_detector.py:142) 12
+
+While off, the only cost is checking the `active` attribute per request.
+"""
+import contextlib
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+# Distinct stacks kept per label; further new stacks are counted as truncated
+MAX_STACKS_PER_LABEL = 5000
+MAX_STACK_DEPTH = 128
+TRUNCATED_STACK = '[truncated]'
+
+# Label of the sampled request this context belongs to, inherited by model calls
+_profile_label = contextvars.ContextVar('profile_label', default=None)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame, max_depth=MAX_STACK_DEPTH):
+    """Semicolon-joined frame names, outermost first"""
+    names = []
+    while frame is not None and len(names) < max_depth:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples the stacks of threads registered with `begin` while active.
+
+    `start(sample_rate, duration)` profiles that fraction of requests,
+    until `stop` or for `duration` seconds when given.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or float(os.getenv('AI_PROFILER_INTERVAL_MS', 5)) / 1000
+        self.active = False
+        self.sample_rate = 1.0
+        self._until = None
+        self._started_at = None
+        self._threads = {}
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._sampler = None
+        self._metrics = {'samples': 0, 'sampled_requests': 0, 'truncated': 0}
+
+    def start(self, sample_rate=1.0, duration=None):
+        """Start a new profiling session, discarding the previous samples"""
+        self.stop()
+        with self._lock:
+            self._stacks = {}
+            self._metrics = {'samples': 0, 'sampled_requests': 0, 'truncated': 0}
+        self.sample_rate = min(1.0, max(0.0, sample_rate))
+        self._started_at = time.time()
+        self._until = time.monotonic() + duration if duration else None
+        self._stop_event = threading.Event()
+        self._sampler = threading.Thread(target=self._run, args=(self._stop_event,),
+                                         name='sampling-profiler', daemon=True)
+        self.active = True
+        self._sampler.start()
+
+    def stop(self):
+        """Stop sampling; collected stacks stay available until the next start"""
+        self.active = False
+        self._stop_event.set()
+        if self._sampler is not None and self._sampler is not threading.current_thread():
+            self._sampler.join()
+        self._sampler = None
+
+    def begin(self, label=None):
+        """Sample the current thread under `label` if this request is selected.
+
+        Without a label the thread joins the sampled request of the current
+        context, if any. Returns a token for `end`, or None when not sampled.
+        """
+        if label is None:
+            label = _profile_label.get()
+            if label is None:
+                return None
+        else:
+            if not self.active or random.random() >= self.sample_rate:
+                return None
+            with self._lock:
+                self._metrics['sampled_requests'] += 1
+
+        ident = threading.get_ident()
+        previous = self._threads.get(ident)
+        self._threads[ident] = label
+        return ident, previous, _profile_label.set(label)
+
+    def end(self, token):
+        if token is None:
+            return
+        ident, previous, label_token = token
+        if previous is None:
+            self._threads.pop(ident, None)
+        else:
+            self._threads[ident] = previous
+        _profile_label.reset(label_token)
+
+    @contextlib.contextmanager
+    def track(self, label=None):
+        """Context manager form of begin/end"""
+        token = self.begin(label)
+        try:
+            yield
+        finally:
+            self.end(token)
+
+    def collapsed_stacks(self, label=None):
+        """Collapsed stack lines (`frames count`), prefixed with their label"""
+        with self._lock:
+            stacks = {name: dict(counts) for name, counts in self._stacks.items()
+                      if label is None or name == label}
+        lines = []
+        for name, counts in sorted(stacks.items()):
+            for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                lines.append(f"{name};{stack} {count}")
+        return '\n'.join(lines) + ('\n' if lines else '')
+
+    def get_status(self):
+        with self._lock:
+            labels = {name: sum(counts.values()) for name, counts in self._stacks.items()}
+            metrics = dict(self._metrics)
+        remaining = None
+        if self.active and self._until is not None:
+            remaining = round(max(0.0, self._until - time.monotonic()), 1)
+        return {
+            'active': self.active,
+            'sample_rate': self.sample_rate,
+            'interval_ms': round(self.interval * 1000, 2),
+            'started_at': self._started_at,
+            'remaining_seconds': remaining,
+            'labels': labels,
+            **metrics,
+        }
+
+    def _run(self, stop_event):
+        while not stop_event.wait(self.interval):
+            if self._until is not None and time.monotonic() >= self._until:
+                self.active = False
+                return
+            threads = self._threads.copy()
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            stacks = [(label, collapse_stack(frames[ident]))
+                      for ident, label in threads.items() if ident in frames]
+            with self._lock:
+                for label, stack in stacks:
+                    counts = self._stacks.setdefault(label, Counter())
+                    if stack not in counts and len(counts) >= MAX_STACKS_PER_LABEL:
+                        stack = TRUNCATED_STACK
+                        self._metrics['truncated'] += 1
+                    counts[stack] += 1
+                    self._metrics['samples'] += 1
+
+
+_default_profiler = None
+_default_profiler_lock = threading.Lock()
+
+
+def get_default_profiler():
+    """Process-wide profiler shared by request handlers, model calls and the mood pipeline"""
+    global _default_profiler
+    with _default_profiler_lock:
+        if _default_profiler is None:
+            _default_profiler = SamplingProfiler()
+        return _default_profiler
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Admission control load test
+Floods an AdmissionController with stats/batch traffic while a few crisis
+clients keep calling, and checks that crisis latency stays bounded, crisis
+traffic is never shed and analytics traffic is shed with 429-style
+rejections. Runs without a Gemini API key; also collected by pytest.
+"""
+
+import os
+import sys
+import threading
+import time
+
+# Add current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from admission import AdmissionController, AdmissionRejected
+from model_router import percentile
+
+DURATION_SECONDS = 3.0
+# Simulated model call held while admitted
+SERVICE_SECONDS = 0.05
+ANALYTICS_THREADS = 60
+CRISIS_THREADS = 4
+# Crisis requests may wait at most this long on top of their own service time
+MAX_CRISIS_P99_SECONDS = SERVICE_SECONDS + 0.1
+
+
+def run_client(controller, priority_class, stop_at, results):
+    while time.monotonic() < stop_at:
+        started = time.monotonic()
+        try:
+            with controller.admit(priority_class):
+                time.sleep(SERVICE_SECONDS)
+        except AdmissionRejected:
+            results['rejected'] += 1
+            # A shed client backs off briefly, as it would on Retry-After
+            time.sleep(0.01)
+            continue
+        results['latencies'].append(time.monotonic() - started)
+
+
+def test_crisis_latency_bounded_under_overload():
+    """Crisis p99 stays bounded and only stats/batch traffic is shed"""
+    controller = AdmissionController(max_concurrency=8, reserved_slots=2)
+    stop_at = time.monotonic() + DURATION_SECONDS
+    results = {name: {'latencies': [], 'rejected': 0} for name in ('crisis', 'stats', 'batch')}
+
+    threads = []
+    for index in range(ANALYTICS_THREADS):
+        priority_class = 'stats' if index % 2 == 0 else 'batch'
+        threads.append(threading.Thread(target=run_client, args=(controller, priority_class, stop_at, results[priority_class])))
+    for _ in range(CRISIS_THREADS):
+        threads.append(threading.Thread(target=run_client, args=(controller, 'crisis', stop_at, results['crisis'])))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    crisis = results['crisis']
+    crisis_p99 = percentile(crisis['latencies'], 0.99)
+    shed = results['stats']['rejected'] + results['batch']['rejected']
+    print(f"🚨 Crisis: {len(crisis['latencies'])} requests, p99 {crisis_p99 * 1000:.1f} ms, {crisis['rejected']} rejected")
+    print(f"📊 Stats/batch: {len(results['stats']['latencies']) + len(results['batch']['latencies'])} served, {shed} shed")
+
+    assert crisis['latencies'], "no crisis request completed"
+    assert crisis['rejected'] == 0, f"{crisis['rejected']} crisis requests were shed"
+    assert crisis_p99 <= MAX_CRISIS_P99_SECONDS, \
+        f"crisis p99 {crisis_p99 * 1000:.1f} ms exceeds {MAX_CRISIS_P99_SECONDS * 1000:.0f} ms"
+    assert results['stats']['rejected'] > 0, "stats traffic was never shed"
+    assert results['batch']['rejected'] > 0, "batch traffic was never shed"
+
+
+if __name__ == "__main__":
+    print("🧪 Running admission load test...")
+    print("=" * 50)
+    try:
+        test_crisis_latency_bounded_under_overload()
+    except AssertionError as e:
+        print(f"❌ Load test failed: {e}")
+        sys.exit(1)
+    print("\n✅ Crisis latency stays bounded under overload")
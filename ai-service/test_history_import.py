@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Columnar history import test
+Imports a small fixed columnar file and checks the per-bucket rollups, the
+latest entries kept per user, merging of users split across chunks, the
+imported/skipped counts on re-import and an export -> import round trip.
+Runs without a Gemini API key; also collected by pytest.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Add current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from gemini_mood_detector import GeminiMoodDetector, MAX_RAW_ENTRIES, ROLLUP_TIERS, rollup_bucket_start
+from mood_columnar import ColumnarWriter
+
+# Start of yesterday (UTC); older rows reach past the hour tier retention
+ANCHOR = int(time.time()) // 86400 * 86400 - 86400
+EMOTIONS = ['joy', 'sadness', 'neutral']
+
+
+def fixed_rows():
+    """Rows per user as (ts, score, emotion, confidence); 'carol' has more than MAX_RAW_ENTRIES"""
+    rows = {'alice': [], 'bob': [], 'carol': []}
+    for index in range(24):
+        rows['alice'].append((ANCHOR - index * 5400, index % 10 + 1, EMOTIONS[index % 3], 0.5))
+    for index in range(9):
+        rows['bob'].append((ANCHOR - index * 86400 * 3, 10 - index, EMOTIONS[(index + 1) % 3], 0.75))
+    for index in range(MAX_RAW_ENTRIES + 30):
+        rows['carol'].append((ANCHOR - index * 3600, index % 7 + 2, 'neutral', 0.25))
+    return rows
+
+
+def write_file(rows):
+    """Write rows to a temporary columnar file, interleaving users so they span chunks"""
+    writer = ColumnarWriter()
+    for part in range(3):
+        for user_id, user_rows in rows.items():
+            part_rows = user_rows[part::3]
+            writer.add_user_rows(
+                user_id,
+                [row[0] for row in part_rows],
+                [row[1] for row in part_rows],
+                [row[2] for row in part_rows],
+                [row[3] for row in part_rows],
+            )
+    return save(writer)
+
+
+def save(writer):
+    with tempfile.NamedTemporaryFile(suffix='.moodcol', delete=False) as output_file:
+        for chunk in writer.iter_bytes():
+            output_file.write(chunk)
+    writer.close()
+    return output_file.name
+
+
+def expected_buckets(user_rows, tier):
+    """Buckets computed row by row, dropping those past the tier's retention"""
+    oldest = rollup_bucket_start(tier, time.time() - ROLLUP_TIERS[tier]['retention_days'] * 86400)
+    buckets = {}
+    for ts, score, _, _ in user_rows:
+        if rollup_bucket_start(tier, ts) < oldest:
+            continue
+        bucket = buckets.setdefault(rollup_bucket_start(tier, ts), [0, 0, score, score])
+        bucket[0] += 1
+        bucket[1] += score
+        bucket[2] = min(bucket[2], score)
+        bucket[3] = max(bucket[3], score)
+    return buckets
+
+
+def test_import_groups_rows_and_keeps_latest_entries():
+    """Rollups match a per-row computation and history keeps each user's newest rows"""
+    rows = fixed_rows()
+    path = write_file(rows)
+    try:
+        detector = GeminiMoodDetector()
+        total = sum(len(user_rows) for user_rows in rows.values())
+        assert detector.import_history(path, chunk_rows=7) == (total, 0, len(rows))
+
+        for user_id, user_rows in rows.items():
+            rollups = detector.user_mood_rollups[user_id]
+            for tier in ('hour', 'day', 'week'):
+                assert rollups[tier] == expected_buckets(user_rows, tier), f"{user_id} {tier} buckets differ"
+
+            newest = sorted(user_rows)[-MAX_RAW_ENTRIES:]
+            history = detector.user_mood_history[user_id]
+            assert [entry['timestamp'] for entry in history] == \
+                [datetime.fromtimestamp(row[0]).isoformat() for row in newest]
+            assert [entry['score'] for entry in history] == [row[1] for row in newest]
+            assert [entry['emotion'] for entry in history] == [row[2] for row in newest]
+        print("✅ Rollups and latest entries match")
+    finally:
+        os.remove(path)
+
+
+def test_chunking_does_not_change_the_result():
+    """Importing in small chunks merges into the same state as one chunk"""
+    path = write_file(fixed_rows())
+    try:
+        whole, chunked = GeminiMoodDetector(), GeminiMoodDetector()
+        whole.import_history(path)
+        chunked.import_history(path, chunk_rows=5)
+        for user_id in fixed_rows():
+            assert chunked.user_mood_history[user_id] == whole.user_mood_history[user_id]
+            for tier in ('hour', 'day', 'week'):
+                assert chunked.user_mood_rollups[user_id][tier] == whole.user_mood_rollups[user_id][tier]
+        print("✅ Chunked import matches single-chunk import")
+    finally:
+        os.remove(path)
+
+
+def test_reimport_and_backfill_accounting():
+    """Re-importing skips every row; a backfill lands even after a live write"""
+    rows = fixed_rows()
+    path = write_file(rows)
+    try:
+        detector = GeminiMoodDetector()
+        detector.store_user_score('alice', 5, 'neutral', 0.8, 'live entry')
+        total = sum(len(user_rows) for user_rows in rows.values())
+        assert detector.import_history(path, chunk_rows=7) == (total, 0, len(rows))
+        assert detector.import_history(path, chunk_rows=7) == (0, total, len(rows))
+        assert detector.get_mood_summary('alice', 30)['statistics']['total_entries'] == len(rows['alice']) + 1
+        print("✅ Re-import skipped, backfill imported")
+    finally:
+        os.remove(path)
+
+
+def test_export_import_round_trip():
+    """Exported history imports into an empty detector unchanged, and is a no-op on the source"""
+    path = write_file(fixed_rows())
+    exported = None
+    try:
+        source = GeminiMoodDetector()
+        source.import_history(path)
+        exported = save(source.export_history())
+
+        target = GeminiMoodDetector()
+        kept = sum(len(history) for _, history in source.user_mood_history.items())
+        assert target.import_history(exported) == (kept, 0, 3)
+        for user_id in fixed_rows():
+            assert target.user_mood_history[user_id] == source.user_mood_history[user_id]
+        assert source.import_history(exported) == (0, kept, 3)
+        print("✅ Export -> import round trip")
+    finally:
+        os.remove(path)
+        if exported:
+            os.remove(exported)
+
+
+if __name__ == "__main__":
+    print("🧪 Running history import tests...")
+    print("=" * 50)
+    try:
+        test_import_groups_rows_and_keeps_latest_entries()
+        test_chunking_does_not_change_the_result()
+        test_reimport_and_backfill_accounting()
+        test_export_import_round_trip()
+    except AssertionError as e:
+        print(f"❌ Import test failed: {e}")
+        sys.exit(1)
+    print("\n✅ History import behaves as expected")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Memory soak test for per-user state
+Churns through many users under a small memory budget and checks that
+resident memory stays flat and that spilled users reload intact, and that
+slow spills happen outside the shared budget lock.
+Runs without a Gemini API key; also collected by pytest.
+"""
+
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Add current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from gemini_mood_detector import GeminiMoodDetector
+from user_state_store import MemoryBudget, UserStateStore, get_default_budget
+
+BUDGET_BYTES = 2 * 1024 * 1024
+USERS = 5000
+WRITES_PER_USER = 3
+# Allowed growth of traced memory between warm-up and the end of the churn
+MAX_GROWTH_BYTES = 512 * 1024
+
+
+def churn(detector, budget, first_user, last_user):
+    """Write and summarize a range of users, checking the budget after each user"""
+    for index in range(first_user, last_user):
+        user_id = f'soak-user-{index}'
+        for write in range(WRITES_PER_USER):
+            detector.store_user_score(user_id, (index + write) % 10 + 1, 'neutral', 0.7, 'soak test entry')
+        detector.get_mood_summary(user_id)
+        detector.get_mood_summary(user_id, 365, 'week')
+        assert budget.total_bytes() <= budget.max_bytes, \
+            f"estimated {budget.total_bytes()} bytes exceeds budget of {budget.max_bytes}"
+
+
+def test_memory_stays_flat_under_churn():
+    """Traced memory stays flat and estimated bytes stay within budget under user churn"""
+    budget = get_default_budget()
+    previous_max_bytes = budget.max_bytes
+    previous_spill_dir = os.environ.get('AI_SPILL_DIR')
+    spill_dir = tempfile.mkdtemp(prefix='mood-soak-')
+    os.environ['AI_SPILL_DIR'] = spill_dir
+    budget.max_bytes = BUDGET_BYTES
+    tracemalloc.start()
+    try:
+        detector = GeminiMoodDetector()
+
+        # Keep a copy of the first user's state to compare after it has been spilled
+        churn(detector, budget, 0, 1)
+        expected_history = copy.deepcopy(detector.user_mood_history['soak-user-0'])
+        expected_rollups = copy.deepcopy(detector.user_mood_rollups['soak-user-0'])
+
+        churn(detector, budget, 1, USERS // 5)
+        warm_bytes, _ = tracemalloc.get_traced_memory()
+        churn(detector, budget, USERS // 5, USERS)
+        final_bytes, _ = tracemalloc.get_traced_memory()
+
+        print(f"📈 Traced memory after warm-up: {warm_bytes / 1024:.0f} KiB, after churn: {final_bytes / 1024:.0f} KiB")
+        print(f"📦 Estimated bytes: {budget.total_bytes()} / {budget.max_bytes}")
+        assert final_bytes - warm_bytes <= MAX_GROWTH_BYTES, \
+            f"traced memory grew by {final_bytes - warm_bytes} bytes under churn"
+
+        # The first user was spilled long ago and must come back unchanged
+        assert detector.user_mood_history.get_metrics()['spills'] > 0
+        assert 'soak-user-0' not in detector.user_mood_history._data
+        assert detector.user_mood_history['soak-user-0'] == expected_history
+        reloaded_rollups = detector.user_mood_rollups['soak-user-0']
+        for tier in ('hour', 'day', 'week'):
+            assert reloaded_rollups[tier] == expected_rollups[tier]
+        assert detector.get_mood_summary('soak-user-0')['statistics']['total_entries'] == WRITES_PER_USER
+        print("✅ Spilled user reloaded intact")
+    finally:
+        tracemalloc.stop()
+        budget.max_bytes = previous_max_bytes
+        if previous_spill_dir is None:
+            os.environ.pop('AI_SPILL_DIR', None)
+        else:
+            os.environ['AI_SPILL_DIR'] = previous_spill_dir
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+class SlowToPickle:
+    """Value whose pickling takes SLOW_PICKLE_SECONDS"""
+
+    def __reduce__(self):
+        time.sleep(SLOW_PICKLE_SECONDS)
+        return (SlowToPickle, ())
+
+
+SLOW_PICKLE_SECONDS = 0.5
+
+
+def test_spill_io_runs_outside_budget_lock():
+    """A slow spill blocks neither other stores' writes nor reads of the user being spilled"""
+    spill_dir = tempfile.mkdtemp(prefix='mood-spill-')
+    try:
+        budget = MemoryBudget(max_bytes=2000)
+        spilling = UserStateStore('slow', lambda value: 1000, budget=budget, spill_dir=spill_dir)
+        other = UserStateStore('other', lambda value: 1000, budget=budget)
+        slow_value = SlowToPickle()
+        spilling['slow-user'] = slow_value
+
+        # Pushes slow-user out; its spill takes SLOW_PICKLE_SECONDS
+        writer = threading.Thread(target=spilling.put, args=('next-user', 'value'))
+        writer.start()
+        time.sleep(SLOW_PICKLE_SECONDS / 5)
+        started = time.monotonic()
+        other['fast-user'] = 'value'
+        blocked = time.monotonic() - started
+        assert blocked < SLOW_PICKLE_SECONDS / 2, f"write waited {blocked:.2f}s on another store's spill"
+
+        # Still readable while being written; reclaiming it discards the spill
+        assert spilling.get('slow-user') is slow_value
+        writer.join()
+        assert not os.path.exists(spilling._spill_path('slow-user')), "reclaimed user was left on disk"
+        assert not [name for name in os.listdir(spilling.spill_dir) if name.endswith('.tmp')]
+        print(f"✅ Write during a slow spill took {blocked * 1000:.0f} ms")
+
+        budget.unregister(other)
+        assert budget.total_bytes() == spilling.bytes
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print("🧪 Running memory soak test...")
+    print("=" * 50)
+    try:
+        test_memory_stays_flat_under_churn()
+        test_spill_io_runs_outside_budget_lock()
+    except AssertionError as e:
+        print(f"❌ Soak test failed: {e}")
+        sys.exit(1)
+    print("\n✅ Memory stays flat under user churn")
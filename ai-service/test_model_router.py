@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Model router test
+Drives ModelRouter with a fake model_factory to check that slow hedged calls
+send a second request that wins, that calls stop being waited on at the
+request deadline, that queued calls are cancelled once it passes, and that
+crisis enrichment goes through its own task and only ever raises the level.
+Runs without a Gemini API key; also collected by pytest.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+# Add current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from deadlines import DeadlineExceeded, reset_deadline, set_deadline
+from gemini_mood_detector import GeminiMoodDetector
+from model_router import MIN_LATENCY_SAMPLES, ModelRouter
+
+TIERS = {'fast': {'model': 'fake-fast', 'latency_budget': 5.0}}
+TASKS = {'mood_json': {'tier': 'fast', 'max_output_tokens': 64, 'hedge': True}}
+
+
+class FakeModel:
+    """Sleeps for scripted latencies (seconds), one per call; the last one repeats"""
+
+    def __init__(self, latencies):
+        self.latencies = list(latencies)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, generation_config=None):
+        with self._lock:
+            index = self.calls
+            self.calls += 1
+        time.sleep(self.latencies[min(index, len(self.latencies) - 1)])
+        return f"answer {index}"
+
+
+def make_router(latencies, hedge_after=None, max_workers=4):
+    """Router whose only tier is a FakeModel; `hedge_after` seeds the p90 used for hedging"""
+    model = FakeModel(latencies)
+    router = ModelRouter(tiers={name: dict(config) for name, config in TIERS.items()},
+                         tasks={name: dict(config) for name, config in TASKS.items()},
+                         model_factory=lambda model_name: model, max_workers=max_workers)
+    if hedge_after is not None:
+        for _ in range(MIN_LATENCY_SAMPLES):
+            router.record_latency('fast', hedge_after)
+    return router, model
+
+
+def with_deadline(seconds, call):
+    token = set_deadline(time.monotonic() + seconds)
+    try:
+        return call()
+    finally:
+        reset_deadline(token)
+
+
+def test_slow_call_is_hedged_and_hedge_wins():
+    """A call slower than the tier p90 gets a second request, whose answer is used"""
+    router, model = make_router([1.0, 0.01], hedge_after=0.05)
+    started = time.monotonic()
+    result = router.generate('mood_json', 'prompt')
+    elapsed = time.monotonic() - started
+
+    assert result == 'answer 1', f"expected the hedge's answer, got {result!r}"
+    assert elapsed < 0.5, f"hedged call took {elapsed:.2f}s"
+    assert model.calls == 2
+    metrics = router.get_metrics()
+    assert metrics['hedges_sent'] == 1 and metrics['hedges_won'] == 1
+    print(f"✅ Hedge won after {elapsed * 1000:.0f} ms")
+
+
+def test_fast_call_is_not_hedged():
+    """A call that beats the p90 never sends a hedge; without samples nothing is hedged"""
+    router, model = make_router([0.01], hedge_after=0.2)
+    assert router.generate('mood_json', 'prompt') == 'answer 0'
+    assert model.calls == 1 and router.get_metrics()['hedges_sent'] == 0
+
+    router, model = make_router([0.1])
+    assert router.generate('mood_json', 'prompt') == 'answer 0'
+    assert model.calls == 1 and router.get_metrics()['hedges_sent'] == 0
+    print("✅ Fast calls are not hedged")
+
+
+def test_deadline_stops_waiting():
+    """The caller gets DeadlineExceeded at the deadline, not when the model answers"""
+    router, model = make_router([1.0])
+    started = time.monotonic()
+    try:
+        with_deadline(0.1, lambda: router.generate('mood_json', 'prompt'))
+        raise AssertionError("slow call did not raise DeadlineExceeded")
+    except DeadlineExceeded:
+        pass
+    elapsed = time.monotonic() - started
+    assert elapsed < 0.5, f"caller waited {elapsed:.2f}s past a 0.1s deadline"
+    assert router.get_metrics()['deadline_exceeded'] == 1
+
+    # An already expired deadline fails before any model call
+    router, model = make_router([0.01])
+    try:
+        with_deadline(-1, lambda: router.generate('mood_json', 'prompt'))
+        raise AssertionError("expired deadline did not raise DeadlineExceeded")
+    except DeadlineExceeded:
+        pass
+    assert model.calls == 0
+    print(f"✅ Deadline stopped the wait after {elapsed * 1000:.0f} ms")
+
+
+def test_queued_hedge_is_cancelled_at_deadline():
+    """A hedge still queued behind a busy worker never runs once the deadline passes"""
+    router, model = make_router([0.6], hedge_after=0.05, max_workers=1)
+    try:
+        with_deadline(0.3, lambda: router.generate('mood_json', 'prompt'))
+        raise AssertionError("slow call did not raise DeadlineExceeded")
+    except DeadlineExceeded:
+        pass
+    assert router.get_metrics()['hedges_sent'] == 1
+
+    # Let the abandoned first call finish; the cancelled hedge must not start after it
+    time.sleep(0.8)
+    assert model.calls == 1, f"cancelled hedge ran ({model.calls} model calls)"
+    print("✅ Queued hedge cancelled at the deadline")
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeCrisisModel:
+    """Answers every prompt with a fixed crisis assessment"""
+
+    def __init__(self, crisis_level):
+        self.crisis_level = crisis_level
+
+    def generate_content(self, prompt, generation_config=None):
+        return FakeResponse(json.dumps({
+            'crisis_level': self.crisis_level,
+            'indicators': ['fake indicator'],
+            'recommended_action': 'Reach out now',
+        }))
+
+
+def test_crisis_enrichment_is_routed_and_only_escalates():
+    """Flagged text is assessed via the crisis_enrichment task; the model cannot lower the level"""
+    router = ModelRouter(model_factory=lambda model_name: FakeCrisisModel('severe'))
+    detector = GeminiMoodDetector(router=router)
+    detection = detector.detect_crisis_situation('I feel like a burden', enrich=True)
+    assert detection['crisis_level'] == 'severe' and detection['requires_immediate_intervention']
+    assert 'fake indicator' in detection['all_indicators']
+    assert not detector.detect_crisis_situation('What a nice day', enrich=True)['is_crisis']
+    assert sum(router.get_metrics()['decisions']['crisis_enrichment'].values()) == 1
+
+    router = ModelRouter(model_factory=lambda model_name: FakeCrisisModel('none'))
+    detector = GeminiMoodDetector(router=router)
+    detection = detector.detect_crisis_situation('I want to kill myself', enrich=True)
+    assert detection['crisis_level'] == 'severe', "model assessment lowered the keyword level"
+    print("✅ Crisis enrichment routed and only escalates")
+
+
+if __name__ == "__main__":
+    print("🧪 Running model router tests...")
+    print("=" * 50)
+    try:
+        test_slow_call_is_hedged_and_hedge_wins()
+        test_fast_call_is_not_hedged()
+        test_deadline_stops_waiting()
+        test_queued_hedge_is_cancelled_at_deadline()
+        test_crisis_enrichment_is_routed_and_only_escalates()
+    except AssertionError as e:
+        print(f"❌ Router test failed: {e}")
+        sys.exit(1)
+    print("\n✅ Hedging and deadlines behave as expected")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Mood rollup and ETag test
+Checks that week buckets start on Monday, that buckets past a tier's
+retention are pruned, that get_mood_statistics picks the tier from the
+window length, and that /user-mood-stats answers 304 until a write or a new
+bucket anchor changes the ETag. Runs without a Gemini API key; also
+collected by pytest.
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from unittest import mock
+
+import numpy as np
+
+# Add current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from gemini_mood_detector import GeminiMoodDetector, ROLLUP_TIERS, rollup_bucket_start, rollup_bucket_starts
+
+# Monday 2024-01-01 00:00 UTC
+MONDAY = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+def test_weeks_start_on_monday():
+    """Week buckets start at Monday 00:00 UTC, scalar and vectorized alike"""
+    samples = [MONDAY, MONDAY + 1, MONDAY + 3 * 86400 + 7200, MONDAY + 7 * 86400 - 1, MONDAY - 1, 0, 1700000000]
+    for ts in samples:
+        start = rollup_bucket_start('week', ts)
+        start_time = datetime.fromtimestamp(start, timezone.utc)
+        assert start_time.weekday() == 0 and start_time.hour == 0 and start_time.minute == 0, \
+            f"week of {ts} starts on {start_time.isoformat()}"
+        assert start <= ts < start + 7 * 86400
+    assert rollup_bucket_start('week', MONDAY + 7 * 86400 - 1) == MONDAY
+    assert rollup_bucket_start('week', MONDAY - 1) == MONDAY - 7 * 86400
+    assert rollup_bucket_starts('week', np.array(samples, dtype=np.int64)).tolist() == \
+        [rollup_bucket_start('week', ts) for ts in samples]
+    print("✅ Weeks start on Monday")
+
+
+def test_buckets_past_retention_are_pruned():
+    """Opening a new bucket drops the tier's buckets older than its retention"""
+    detector = GeminiMoodDetector()
+    now = time.time()
+    old = now - (ROLLUP_TIERS['hour']['retention_days'] + 1) * 86400
+    detector._update_rollups('pruned-user', old, 4)
+    detector._update_rollups('pruned-user', now, 6)
+
+    rollups = detector.user_mood_rollups['pruned-user']
+    assert list(rollups['hour']) == [rollup_bucket_start('hour', now)], "expired hour bucket was kept"
+    assert rollup_bucket_start('day', old) in rollups['day'], "day bucket within retention was pruned"
+    assert sum(bucket[0] for bucket in rollups['week'].values()) == 2
+    print("✅ Expired buckets pruned per tier")
+
+
+def test_statistics_tier_follows_window():
+    """Windows within the day retention use day buckets; longer ones use week buckets"""
+    detector = GeminiMoodDetector()
+    now = time.time()
+    day_retention = ROLLUP_TIERS['day']['retention_days']
+    # Older than the day retention: only the week tier still has it once a new day opens
+    detector._update_rollups('tier-user', now - (day_retention + 30) * 86400, 2)
+    detector._update_rollups('tier-user', now - 3 * 86400, 6)
+    detector._update_rollups('tier-user', now, 10)
+
+    assert detector.get_mood_statistics('tier-user', 1)['total_entries'] == 1
+    assert detector.get_mood_statistics('tier-user', 30)['total_entries'] == 2
+    assert detector.get_mood_statistics('tier-user', day_retention)['total_entries'] == 2
+    long_window = detector.get_mood_statistics('tier-user', day_retention + 60)
+    assert long_window['total_entries'] == 3
+    assert long_window['min_score'] == 2 and long_window['max_score'] == 10
+    assert long_window['average_score'] == 6
+    print("✅ Statistics tier follows the window length")
+
+
+def test_etag_answers_304_until_data_or_anchor_changes():
+    """If-None-Match gets 304 while unchanged; a write or a new day anchor changes the ETag"""
+    from app import app, mood_detector
+
+    client = app.test_client()
+    url = '/user-mood-stats?userId=etag-user&days=7'
+    mood_detector.store_user_score('etag-user', 6, 'neutral', 0.8, 'first entry')
+
+    first = client.get(url)
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and first.get_json()['statistics']['total_entries'] == 1
+
+    unchanged = client.get(url, headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+    assert unchanged.headers['ETag'] == etag
+
+    mood_detector.store_user_score('etag-user', 3, 'sadness', 0.8, 'second entry')
+    after_write = client.get(url, headers={'If-None-Match': etag})
+    assert after_write.status_code == 200
+    assert after_write.headers['ETag'] != etag
+    assert after_write.get_json()['statistics']['total_entries'] == 2
+
+    # The window moves at midnight UTC even without new entries
+    etag = after_write.headers['ETag']
+    tomorrow = rollup_bucket_start('day', time.time()) + 86400 + 60
+    with mock.patch('gemini_mood_detector.time.time', return_value=tomorrow):
+        next_day = client.get(url, headers={'If-None-Match': etag})
+    assert next_day.status_code == 200
+    assert next_day.headers['ETag'] != etag
+
+    hourly = client.get(url + '&resolution=hour')
+    etag = hourly.headers['ETag']
+    next_hour = rollup_bucket_start('hour', time.time()) + 3600 + 60
+    with mock.patch('gemini_mood_detector.time.time', return_value=next_hour):
+        assert client.get(url + '&resolution=hour', headers={'If-None-Match': etag}).status_code == 200
+    print("✅ ETag revalidation follows writes and bucket anchors")
+
+
+if __name__ == "__main__":
+    print("🧪 Running mood rollup tests...")
+    print("=" * 50)
+    try:
+        test_weeks_start_on_monday()
+        test_buckets_past_retention_are_pruned()
+        test_statistics_tier_follows_window()
+        test_etag_answers_304_until_data_or_anchor_changes()
+    except AssertionError as e:
+        print(f"❌ Rollup test failed: {e}")
+        sys.exit(1)
+    print("\n✅ Rollups and ETags behave as expected")
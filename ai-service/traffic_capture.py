@@ -0,0 +1,156 @@
+"""Anonymized traffic capture and replay support.
+
+With AI_TRACE_FILE set, every request to a traced route appends one JSON line:
+
+    {"start": 1760000000.123, "route": "/chat", "user": "3f2a9c...",
+     "text_len": 42, "status": 200, "duration_ms": 812.4,
+     "model_ms": [301.2, 488.0]}
+
+No message text is stored; user ids are salted hashes. With
+AI_TRACE_CRISIS_FLAG=1 records also carry a "crisis" flag (crisis language
+present) so replays reproduce crisis scheduling; flagged records then omit
+the user hash so a pseudonymous user is never linked to crisis language.
+With AI_REPLAY_MODE=1
+the service answers model calls with ReplayModel, which sleeps for the
+latencies sent by replay_traffic.py instead of calling Gemini.
+"""
+import contextvars
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+from gemini_mood_detector import contains_crisis_language
+from model_router import ModelRouter
+
+# Route -> request field holding the user's text
+TRACED_ROUTES = {
+    '/chat': 'message',
+    '/detect-emotion': 'text',
+    '/analyze-text': 'text',
+    '/crisis-check': 'text',
+}
+
+# Comma-separated model latencies (ms) the replay model should reproduce, in call order
+REPLAY_LATENCY_HEADER = 'X-Replay-Model-Latency-Ms'
+
+# Latencies (seconds) still to be served to the current request
+_replay_latencies = contextvars.ContextVar('replay_latencies', default=None)
+
+
+class TrafficRecorder:
+    """Appends one anonymized JSON line per traced request"""
+
+    def __init__(self, path, salt=None, record_crisis=False):
+        self.path = path
+        self.salt = (salt or os.urandom(16).hex()).encode('utf-8')
+        self.record_crisis = record_crisis
+        self._file = open(path, 'a', buffering=1, encoding='utf-8')
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    @classmethod
+    def from_env(cls):
+        """Recorder writing to AI_TRACE_FILE, or None when capture is off"""
+        path = os.getenv('AI_TRACE_FILE')
+        if not path:
+            return None
+        return cls(path, salt=os.getenv('AI_TRACE_SALT'),
+                   record_crisis=os.getenv('AI_TRACE_CRISIS_FLAG') == '1')
+
+    def hash_user(self, user_id):
+        if user_id is None:
+            return None
+        digest = hmac.new(self.salt, str(user_id).encode('utf-8'), hashlib.sha256)
+        return digest.hexdigest()[:16]
+
+    def begin(self, route, data):
+        """Start a trace for a request to `route` with JSON body `data`"""
+        data = data if isinstance(data, dict) else {}
+        text = data.get(TRACED_ROUTES[route])
+        text = text if isinstance(text, str) else ''
+        trace = {
+            'start': round(time.time(), 3),
+            'route': route,
+            'user': self.hash_user(data.get('userId')),
+            'text_len': len(text),
+            '_started': time.monotonic(),
+        }
+        if self.record_crisis:
+            trace['crisis'] = contains_crisis_language(text)
+            if trace['crisis']:
+                trace['user'] = None
+        return trace
+
+    def finish(self, trace, status, model_latencies):
+        """Write a trace once the response status is known"""
+        trace['status'] = status
+        trace['duration_ms'] = round((time.monotonic() - trace.pop('_started')) * 1000, 1)
+        trace['model_ms'] = [round(seconds * 1000, 1) for seconds in model_latencies]
+        line = json.dumps(trace) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def set_replay_latencies(headers):
+    """Load the replay latencies sent with a request; returns a token for reset"""
+    latencies = []
+    for value in headers.get(REPLAY_LATENCY_HEADER, '').split(','):
+        try:
+            latencies.append(max(0.0, float(value) / 1000))
+        except ValueError:
+            continue
+    return _replay_latencies.set(latencies)
+
+
+def reset_replay_latencies(token):
+    _replay_latencies.reset(token)
+
+
+class ReplayResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class ReplayModel:
+    """Stand-in for a Gemini model that reproduces recorded call latencies.
+
+    Each call consumes the next latency sent with the request; once they run
+    out the last one is reused, so a version that makes extra model calls
+    pays for them at a realistic cost.
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, generation_config=None):
+        latencies = _replay_latencies.get() or [0.0]
+        time.sleep(latencies.pop(0) if len(latencies) > 1 else latencies[0])
+
+        if 'JSON' in prompt:
+            return ReplayResponse(json.dumps({
+                'primary_emotion': 'neutral',
+                'sentiment': 'neutral',
+                'intensity': 'medium',
+                'confidence': 0.8,
+            }))
+        return ReplayResponse("Thank you for sharing that with me. How are you feeling right now?")
+
+
+def create_replay_router():
+    """Router backed by ReplayModel.
+
+    Hedging is turned off because recorded latencies are already what the
+    request waited for, hedges included.
+    """
+    router = ModelRouter(model_factory=ReplayModel)
+    for task_config in router.tasks.values():
+        task_config['hedge'] = False
+    return router
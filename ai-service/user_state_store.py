@@ -0,0 +1,287 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+# Rough per-user bookkeeping cost (dict slots, key string, LRU links)
+USER_OVERHEAD_BYTES = 300
+
+
+class MemoryBudget:
+    """Global byte budget shared by every UserStateStore.
+
+    When the estimated total goes over budget, the least recently used user
+    across all registered stores is evicted first. Users idle for longer than
+    `max_idle_seconds` are evicted even while under budget. Victims are picked
+    under the budget lock; spilling them to disk happens after it is released.
+    """
+
+    def __init__(self, max_bytes=None, max_idle_seconds=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv('AI_MEMORY_BUDGET_MB', 256)) * 1024 * 1024)
+        if max_idle_seconds is None and os.getenv('AI_USER_IDLE_SECONDS'):
+            max_idle_seconds = float(os.getenv('AI_USER_IDLE_SECONDS'))
+        self.max_bytes = max_bytes
+        self.max_idle_seconds = max_idle_seconds
+        self._stores = []
+        self._lock = threading.Lock()
+
+    def register(self, store):
+        with self._lock:
+            self._stores.append(store)
+
+    def unregister(self, store):
+        """Stop accounting for `store`; its resident users no longer count against the budget"""
+        with self._lock:
+            if store in self._stores:
+                self._stores.remove(store)
+
+    def total_bytes(self):
+        return sum(store.bytes for store in self._stores)
+
+    def enforce(self):
+        """Evict idle and least recently used users until within budget"""
+        victims = []
+        with self._lock:
+            if self.max_idle_seconds is not None:
+                idle_cutoff = time.monotonic() - self.max_idle_seconds
+                for store in self._stores:
+                    while store.oldest_access() < idle_cutoff:
+                        victims.append((store, store.detach_oldest()))
+
+            while self.total_bytes() > self.max_bytes:
+                candidates = [store for store in self._stores if len(store)]
+                if not candidates:
+                    break
+                store = min(candidates, key=lambda store: store.oldest_access())
+                victims.append((store, store.detach_oldest()))
+
+        # Pickling and disk writes must not hold up every other store's writers
+        for store, victim in victims:
+            if victim is not None:
+                store.spill(*victim)
+
+    def get_metrics(self):
+        """Resident users and estimated bytes per store"""
+        stores = {store.name: store.get_metrics() for store in self._stores}
+        return {
+            'max_bytes': self.max_bytes,
+            'estimated_bytes': sum(metrics['estimated_bytes'] for metrics in stores.values()),
+            'resident_users': sum(metrics['resident_users'] for metrics in stores.values()),
+            'stores': stores,
+        }
+
+
+_default_budget = None
+_default_budget_lock = threading.Lock()
+
+
+def get_default_budget():
+    """Process-wide budget shared by the chatbot and mood detector"""
+    global _default_budget
+    with _default_budget_lock:
+        if _default_budget is None:
+            _default_budget = MemoryBudget()
+        return _default_budget
+
+
+class UserStateStore:
+    """Dict-like per-user state with LRU eviction under a MemoryBudget.
+
+    `sizer(value)` estimates the bytes held by one user's value and is called
+    on every write, so values mutated in place must be written back. When a
+    spill directory is configured, evicted users are pickled to disk and
+    reloaded transparently on the next access; otherwise they are dropped.
+    A user being spilled stays readable from memory until its file is in place.
+    """
+
+    def __init__(self, name, sizer, budget=None, spill_dir=None):
+        self.name = name
+        self.sizer = sizer
+        self.budget = budget or get_default_budget()
+        if spill_dir is None:
+            spill_dir = os.getenv('AI_SPILL_DIR')
+        self.spill_dir = os.path.join(spill_dir, name) if spill_dir else None
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._access = {}
+        # Evicted users whose spill file is still being written
+        self._spilling = {}
+        self._lock = threading.RLock()
+        self.bytes = 0
+        self._metrics = {'evictions': 0, 'spills': 0, 'reloads': 0}
+        self.budget.register(self)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, user_id):
+        with self._lock:
+            if user_id in self._data or user_id in self._spilling:
+                return True
+        return self.spill_dir is not None and os.path.exists(self._spill_path(user_id))
+
+    def __getitem__(self, user_id):
+        value = self.get(user_id, _MISSING)
+        if value is _MISSING:
+            raise KeyError(user_id)
+        return value
+
+    def __setitem__(self, user_id, value):
+        self.put(user_id, value)
+
+    def get(self, user_id, default=None):
+        with self._lock:
+            if user_id in self._data:
+                self._data.move_to_end(user_id)
+                self._access[user_id] = time.monotonic()
+                return self._data[user_id]
+            if user_id in self._spilling:
+                # Evicted but not on disk yet: take it back before the spill lands
+                value = self._spilling.pop(user_id)
+                self._insert(user_id, value)
+                return value
+        value = self._reload(user_id)
+        return default if value is _MISSING else value
+
+    def put(self, user_id, value):
+        with self._lock:
+            self._insert(user_id, value)
+        self.budget.enforce()
+
+    def setdefault(self, user_id, default):
+        value = self.get(user_id, _MISSING)
+        if value is _MISSING:
+            self.put(user_id, default)
+            value = default
+        return value
+
+    def pop(self, user_id, default=None):
+        value = self.get(user_id, _MISSING)
+        if value is _MISSING:
+            return default
+        with self._lock:
+            self._remove(user_id)
+        return value
+
+    def items(self):
+        """Iterate over every user, resident or spilled, without reloading spilled users"""
+        with self._lock:
+            resident = list(self._data.items()) + list(self._spilling.items())
+        yield from resident
+        if not self.spill_dir:
+            return
+        resident_ids = {user_id for user_id, _ in resident}
+        for name in os.listdir(self.spill_dir):
+            if not name.endswith('.pkl'):
+                continue
+            try:
+                with open(os.path.join(self.spill_dir, name), 'rb') as spill_file:
+                    user_id, value = pickle.load(spill_file)
+            except FileNotFoundError:
+                # Reloaded into memory since the listing
+                continue
+            if user_id not in resident_ids:
+                yield user_id, value
+
+    def oldest_access(self):
+        with self._lock:
+            if not self._data:
+                return float('inf')
+            return self._access[next(iter(self._data))]
+
+    def detach_oldest(self):
+        """Remove the least recently used user from memory.
+
+        Returns (user_id, value) for `spill`, or None when the store is empty.
+        """
+        with self._lock:
+            if not self._data:
+                return None
+            user_id, value = next(iter(self._data.items()))
+            self._remove(user_id)
+            self._metrics['evictions'] += 1
+            if self.spill_dir:
+                self._spilling[user_id] = value
+            return user_id, value
+
+    def spill(self, user_id, value):
+        """Write a detached user to disk; a no-op without a spill directory"""
+        if not self.spill_dir:
+            return
+        path = self._spill_path(user_id)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        while True:
+            try:
+                with open(temp_path, 'wb') as spill_file:
+                    pickle.dump((user_id, value), spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+                break
+            except RuntimeError:
+                # Changed while being pickled, normally by a writer that reclaimed it
+                with self._lock:
+                    if self._spilling.get(user_id) is not value:
+                        os.remove(temp_path)
+                        return
+        with self._lock:
+            if self._spilling.get(user_id) is value:
+                del self._spilling[user_id]
+                os.replace(temp_path, path)
+                self._metrics['spills'] += 1
+                return
+        # Reclaimed by a reader while being written; memory holds the newer copy
+        os.remove(temp_path)
+
+    def close(self):
+        """Unregister from the budget; the store keeps working but is no longer evicted"""
+        self.budget.unregister(self)
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                'resident_users': len(self._data),
+                'estimated_bytes': self.bytes,
+                **self._metrics,
+            }
+
+    def _insert(self, user_id, value):
+        size = self.sizer(value) + USER_OVERHEAD_BYTES
+        self.bytes += size - self._sizes.get(user_id, 0)
+        self._sizes[user_id] = size
+        self._data[user_id] = value
+        self._data.move_to_end(user_id)
+        self._access[user_id] = time.monotonic()
+
+    def _remove(self, user_id):
+        del self._data[user_id]
+        del self._access[user_id]
+        self.bytes -= self._sizes.pop(user_id)
+
+    def _reload(self, user_id):
+        if not self.spill_dir:
+            return _MISSING
+        path = self._spill_path(user_id)
+        with self._lock:
+            # Another thread may have reloaded the user while we waited
+            if user_id in self._data:
+                return self._data[user_id]
+            try:
+                with open(path, 'rb') as spill_file:
+                    _, value = pickle.load(spill_file)
+            except FileNotFoundError:
+                return _MISSING
+            os.remove(path)
+            self._metrics['reloads'] += 1
+            self._insert(user_id, value)
+        self.budget.enforce()
+        return value
+
+    def _spill_path(self, user_id):
+        digest = hashlib.sha256(str(user_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, f'{digest}.pkl')
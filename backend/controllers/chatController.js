@@ -2,6 +2,11 @@ const ChatMessage = require('../models/ChatMessage');
 const Community = require('../models/Community');
 const axios = require('axios');
 
+// Budget for AI service calls; the AI service stops working on the request once it passes
+const AI_SERVICE_TIMEOUT_MS = parseInt(process.env.AI_SERVICE_TIMEOUT_MS, 10) || 15000;
+// Deadline sent to the AI service, kept below the axios timeout so its fallback reply arrives in time
+const AI_SERVICE_BUDGET_MS = Math.max(AI_SERVICE_TIMEOUT_MS - 1000, Math.floor(AI_SERVICE_TIMEOUT_MS * 0.8));
+
 // Send message to chatbot
 const sendChatMessage = async (req, res) => {
   try {
@@ -25,6 +30,10 @@ const sendChatMessage = async (req, res) => {
           message,
           userId: req.user._id.toString(),
           userHistory: await getUserChatHistoryHelper(req.user._id, 10),
+        },
+        {
+          timeout: AI_SERVICE_TIMEOUT_MS,
+          headers: { 'X-Request-Timeout-Ms': AI_SERVICE_BUDGET_MS },
         }
       );
 
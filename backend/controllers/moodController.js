@@ -2,6 +2,11 @@ const MoodEntry = require('../models/MoodEntry');
 const User = require('../models/User');
 const axios = require('axios');
 
+// Budget for AI service calls; the AI service stops working on the request once it passes
+const AI_SERVICE_TIMEOUT_MS = parseInt(process.env.AI_SERVICE_TIMEOUT_MS, 10) || 15000;
+// Deadline sent to the AI service, kept below the axios timeout so its fallback reply arrives in time
+const AI_SERVICE_BUDGET_MS = Math.max(AI_SERVICE_TIMEOUT_MS - 1000, Math.floor(AI_SERVICE_TIMEOUT_MS * 0.8));
+
 // Create new mood entry
 const createMoodEntry = async (req, res) => {
   try {
@@ -26,6 +31,9 @@ const createMoodEntry = async (req, res) => {
         score,
         mood,
         emotions
+      }, {
+        timeout: AI_SERVICE_TIMEOUT_MS,
+        headers: { 'X-Request-Timeout-Ms': AI_SERVICE_BUDGET_MS }
       });
       
       moodEntry.aiAnalysis = aiResponse.data.analysis;